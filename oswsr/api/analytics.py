@@ -0,0 +1,137 @@
+from datetime import datetime, time
+
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .archive import get_archived_shifts
+from .models import Order, OrderMenu, DailyRevenue
+from .reference import reference_data
+
+
+class RevenueReport:
+    """
+    Revenue, order count and covers of the orders created in ``[start, end)``.
+
+    Every bucket is computed by a grouped query, only the aggregated rows
+    reach Python. Day, table and worker buckets read closed shifts from the
+    ``DailyRevenue`` rollups when the range starts and ends at midnight, and
+    aggregate the orders of the remaining shifts. Menu buckets count the
+    quantity of the item instead of covers. Archived shifts have no orders
+    left, they are only counted through their rollups. Otherwise the report
+    is marked incomplete when archived shifts overlap the range.
+    """
+
+    group_choices = ['hour', 'day', 'table', 'worker', 'menu']
+
+    def __init__(self, start=None, end=None, group_by='day'):
+        self.start = start
+        self.end = end
+        self.group_by = group_by
+
+    def filter_range(self, queryset, field):
+        if self.start is not None:
+            queryset = queryset.filter(**{field + '__gte': self.start})
+        if self.end is not None:
+            queryset = queryset.filter(**{field + '__lt': self.end})
+        return queryset
+
+    def is_midnight(self, value):
+        return value is None or timezone.localtime(value).time() == time.min
+
+    @property
+    def uses_rollups(self):
+        return self.group_by in ('day', 'table', 'worker') and self.is_midnight(self.start) \
+            and self.is_midnight(self.end)
+
+    def get_orders(self):
+        orders = self.filter_range(Order.objects.all(), 'created_at')
+        if self.uses_rollups:
+            orders = orders.exclude(shift_worker__work_shift_id__in=DailyRevenue.objects.values('work_shift_id'))
+        return orders
+
+    def get_rollups(self):
+        rollups = DailyRevenue.objects.all()
+        if self.start is not None:
+            rollups = rollups.filter(date__gte=timezone.localdate(self.start))
+        if self.end is not None:
+            rollups = rollups.filter(date__lt=timezone.localdate(self.end))
+        return rollups
+
+    def order_rows(self):
+        keys = {
+            'hour': {'key': TruncHour('created_at')},
+            'day': {'key': TruncDay('created_at')},
+            'table': {'key': F('table_id')},
+            'worker': {'key': F('shift_worker__user_id'), 'name': F('shift_worker__user__name')},
+        }[self.group_by]
+        return self.get_orders().values(**keys) \
+            .annotate(revenue=Sum('total_price'), orders=Count('id'), covers=Sum('number_of_person')) \
+            .order_by()
+
+    def rollup_rows(self):
+        keys = {
+            'day': {'key': F('date')},
+            'table': {'key': F('table_id')},
+            'worker': {'key': F('user_id'), 'name': F('user__name')},
+        }[self.group_by]
+        return self.get_rollups().values(**keys) \
+            .annotate(revenue=Sum('revenue'), orders=Sum('orders'), covers=Sum('covers')) \
+            .order_by()
+
+    def menu_rows(self):
+        items = self.filter_range(OrderMenu.objects.all(), 'order__created_at')
+        return items.values(key=F('menu_id')) \
+            .annotate(revenue=Sum(F('menu__price') * F('quantity')), orders=Count('order_id', distinct=True),
+                      quantity=Sum('quantity')) \
+            .order_by()
+
+    def get_buckets(self):
+        if self.group_by == 'menu':
+            buckets = {row['key']: row for row in self.menu_rows()}
+        else:
+            rows = list(self.order_rows())
+            if self.uses_rollups:
+                rows += self.rollup_rows()
+            buckets = {}
+            for row in rows:
+                key = row['key']
+                if self.group_by == 'day' and not isinstance(key, datetime):
+                    key = timezone.make_aware(datetime.combine(key, time.min))
+                bucket = buckets.setdefault(key, dict(row, key=key, revenue=0, orders=0, covers=0))
+                bucket['revenue'] += row['revenue'] or 0
+                bucket['orders'] += row['orders']
+                bucket['covers'] += row['covers'] or 0
+
+        buckets = sorted(buckets.values(), key=lambda bucket: bucket['key'])
+        for bucket in buckets:
+            bucket['revenue'] = bucket['revenue'] or 0
+            if self.group_by == 'table':
+                bucket['name'] = reference_data.get('tables', bucket['key']).name
+            elif self.group_by == 'menu':
+                bucket['name'] = reference_data.get('menus', bucket['key']).name
+        return buckets
+
+    def get_total(self, buckets):
+        if self.group_by != 'menu':
+            return {name: sum(bucket[name] for bucket in buckets) for name in ['revenue', 'orders', 'covers']}
+        # an order with several menu items is in several buckets
+        total = self.get_orders().aggregate(revenue=Sum('total_price'), orders=Count('id'),
+                                            covers=Sum('number_of_person'))
+        return {
+            'revenue': total['revenue'] or 0,
+            'orders': total['orders'],
+            'covers': total['covers'] or 0,
+        }
+
+    @property
+    def data(self):
+        buckets = self.get_buckets()
+        return {
+            'group_by': self.group_by,
+            'start': self.start,
+            'end': self.end,
+            'buckets': buckets,
+            'total': self.get_total(buckets),
+            'complete': self.uses_rollups or not get_archived_shifts(self.start, self.end).exists(),
+        }
@@ -0,0 +1,85 @@
+"""
+Archival of the orders of old closed shifts.
+
+An archived shift keeps its ``WorkShift`` row, price rollup and daily
+revenue rollups. Its orders move into a ``ShiftArchive`` as the zlib
+compressed JSON of the ``orders`` list of the shift report, and its orders,
+order items and shift workers are deleted from the hot tables.
+"""
+import json
+import zlib
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching
+from .models import WorkShift, ShiftWorker, Order, OrderMenu, DailyRevenue, ShiftArchive
+from .renderers import JSONRenderer
+from .serializers import OrderValuesSerializer
+
+
+def pack_orders(orders):
+    # rendered like the live report, so the archived shift renders the same
+    return zlib.compress(JSONRenderer().render(orders))
+
+
+def unpack_orders(data):
+    return json.loads(zlib.decompress(data))
+
+
+def get_archived_orders(work_shift):
+    archive = ShiftArchive.objects.filter(work_shift=work_shift).values_list('orders', flat=True).first()
+    return [] if archive is None else unpack_orders(archive)
+
+
+def get_archivable_shifts(retention_days):
+    """Closed shifts that ended more than ``retention_days`` ago and are not archived yet."""
+    return WorkShift.objects.filter(active=False, archived_at__isnull=True,
+                                    end__lt=timezone.now() - timedelta(days=retention_days))
+
+
+def get_archived_shifts(start=None, end=None):
+    """Archived shifts that overlap ``[start, end)``, their orders are no longer in the orders table."""
+    shifts = WorkShift.objects.filter(archived_at__isnull=False)
+    if start is not None:
+        shifts = shifts.filter(end__gte=start)
+    if end is not None:
+        shifts = shifts.filter(start__lt=end)
+    return shifts
+
+
+def archive_shifts(work_shift_ids):
+    """Archives the shifts in one transaction. Returns the ids of the archived shifts and their order count."""
+    with transaction.atomic():
+        # a shift reopened since it was selected stays in the hot tables
+        work_shift_ids = list(WorkShift.objects.select_for_update()
+                              .filter(id__in=work_shift_ids, active=False, archived_at__isnull=True)
+                              .values_list('id', flat=True))
+        if not work_shift_ids:
+            return [], 0
+
+        # the analytics read archived shifts from their rollups
+        DailyRevenue.rollup(WorkShift.objects.filter(id__in=work_shift_ids)
+                            .exclude(id__in=DailyRevenue.objects.values('work_shift_id')).values('id'))
+
+        serializer = OrderValuesSerializer()
+        rows = serializer.values(Order.objects.filter(shift_worker__work_shift_id__in=work_shift_ids)
+                                 .order_by('shift_worker__work_shift_id', 'shift_worker_id', 'id'),
+                                 'shift_worker__work_shift_id')
+        orders = {work_shift_id: [] for work_shift_id in work_shift_ids}
+        for row in rows.iterator():
+            orders[row['shift_worker__work_shift_id']].append(serializer.to_representation(row))
+        ShiftArchive.objects.bulk_create([
+            ShiftArchive(work_shift_id=work_shift_id, orders=pack_orders(shift_orders), order_count=len(shift_orders))
+            for work_shift_id, shift_orders in orders.items()
+        ])
+
+        # raw deletes skip the signals, which would reset the price rollups of the shifts
+        for queryset in [OrderMenu.objects.filter(order__shift_worker__work_shift_id__in=work_shift_ids),
+                         Order.objects.filter(shift_worker__work_shift_id__in=work_shift_ids),
+                         ShiftWorker.objects.filter(work_shift_id__in=work_shift_ids)]:
+            queryset._raw_delete(queryset.db)
+        WorkShift.objects.filter(id__in=work_shift_ids).update(archived_at=timezone.now())
+        caching.bump_versions(caching.work_shift_key(work_shift_id) for work_shift_id in work_shift_ids)
+    return work_shift_ids, sum(len(shift_orders) for shift_orders in orders.values())
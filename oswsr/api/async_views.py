@@ -0,0 +1,143 @@
+"""
+Async versions of the read-heavy endpoints for the ASGI application.
+
+Authentication is served from the token cache without leaving the event
+loop. Django 3.2 has no async ORM API yet, so the queries run through
+``sync_to_async`` on the thread-sensitive executor.
+"""
+import asyncio
+import math
+from functools import wraps
+from io import BytesIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.request import Request
+
+from .authentication import BearerTokenAuthentication
+from .events import hub, DROPPED
+from .exceptions import CafeAPIException
+from .models import WorkShift
+from .permissions import IsAuthenticated, IsAdmin
+from .reference import reference_data
+from .renderers import JSONRenderer
+from .reports import ShiftOrdersReport
+from .throttling import check_throttles
+from .views import UserList
+
+
+def render(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+def async_api_view(permission_classes=()):
+    """Authenticates the request and checks the permission classes before running the async view."""
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return render({'detail': 'Method "%s" not allowed.' % request.method},
+                              status.HTTP_405_METHOD_NOT_ALLOWED)
+            request = Request(request)
+            try:
+                user_auth = await BearerTokenAuthentication().aauthenticate(request)
+                request.user, request.auth = user_auth or (None, None)
+                if not reference_data.is_current():
+                    # the permissions read the reference data, which loads from the database
+                    await sync_to_async(reference_data.load)()
+                for permission in permission_classes:
+                    permission().has_permission(request, view)
+                check_throttles(request, view)
+                data = await view(request, *args, **kwargs)
+            except APIException as exc:
+                detail = exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail}
+                response = render(detail, exc.status_code)
+                if getattr(exc, 'wait', None) is not None:
+                    response['Retry-After'] = '%d' % math.ceil(exc.wait)
+                return response
+            return render(data)
+        return wrapper
+
+    return decorator
+
+
+@async_api_view(permission_classes=[IsAdmin])
+async def user_list(request):
+    response = await sync_to_async(UserList().list)(request)
+    return response.data
+
+
+@async_api_view(permission_classes=[IsAdmin])
+async def work_shift_orders(request, pk):
+    work_shift = await sync_to_async(WorkShift.objects.filter(pk=pk).first)()
+    if work_shift is None:
+        raise NotFound()
+    report = ShiftOrdersReport(work_shift)
+    return {
+        'data': await sync_to_async(lambda: report.data)()
+    }
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def order_feed(scope, receive, send):
+    """
+    ASGI application streaming the order events of the active shift as Server-Sent Events.
+
+    Django 3.2 iterates streaming responses synchronously, so the feed talks
+    ASGI directly and is routed by ``oswsr/asgi.py``. A comment line is sent
+    every ``API_EVENTS_KEEPALIVE`` seconds while the shift is quiet.
+    """
+    request = ASGIRequest(scope, BytesIO())
+    try:
+        user_auth = await BearerTokenAuthentication().aauthenticate(request)
+        request.user = user_auth[0] if user_auth else None
+        IsAuthenticated().has_permission(request, None)
+        work_shift_id = await sync_to_async(
+            WorkShift.objects.filter(active=True).values_list('id', flat=True).first)()
+        if work_shift_id is None:
+            raise CafeAPIException(message='Forbidden. There are no open shifts!',
+                                   code=status.HTTP_403_FORBIDDEN)
+    except APIException as exc:
+        await send({'type': 'http.response.start', 'status': exc.status_code,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': JSONRenderer().render(exc.detail)})
+        return
+
+    keepalive = getattr(settings, 'API_EVENTS_KEEPALIVE', 15)
+    subscriber = hub.subscribe(work_shift_id)
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': status.HTTP_200_OK, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+        while True:
+            event = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait({event, disconnect}, timeout=keepalive,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if event not in done:
+                event.cancel()
+                if disconnect in done:
+                    return
+                frame = b': keepalive\n\n'
+            else:
+                frame = event.result()
+            if frame is DROPPED:
+                # the client did not keep up, it can reconnect and reload the report
+                await send({'type': 'http.response.body', 'body': b'event: dropped\ndata: {}\n\n'})
+                return
+            await send({'type': 'http.response.body', 'body': frame, 'more_body': True})
+    finally:
+        hub.unsubscribe(subscriber)
+        disconnect.cancel()
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.authentication import BaseAuthentication
+
+from . import caching
+from .models import ApiToken
+from .utilities import get_bearer_token
+
+
+def get_version_keys(token, user_id):
+    return [caching.token_key(ApiToken.hash_key(token)), caching.user_key(user_id)]
+
+
+class TokenCache:
+    """
+    In-process LRU cache of api tokens to authenticated users.
+
+    Entries expire after ``ttl`` seconds, and the least recently used entry
+    is evicted once ``max_size`` tokens are cached. An entry also holds the
+    versions of its token and user in the shared api cache. A hit is only
+    served while they are unchanged, so a token revoked or a user changed by
+    another worker stops authenticating at once.
+    """
+
+    def __init__(self, ttl=300, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user, expires, versions = entry
+            if expires <= time.monotonic():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+        if caching.get_versions(get_version_keys(token, user.pk)) != versions:
+            self.invalidate(token)
+            return None
+        return user
+
+    def set(self, token, user, versions, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._entries[token] = (user, time.monotonic() + ttl, versions)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for token in [token for token, (user, _, _) in self._entries.items() if user.pk == user_id]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(ttl=getattr(settings, 'API_TOKEN_CACHE_TTL', 300),
+                         max_size=getattr(settings, 'API_TOKEN_CACHE_SIZE', 1024))
+
+
+class BearerTokenAuthentication(BaseAuthentication):
+    """
+    Resolves the ``Authorization: Bearer <token>`` header once per request.
+
+    Unknown tokens are not an authentication error here: the request stays
+    anonymous and the permission classes answer with the API error format.
+    """
+
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        token = get_bearer_token(request, keyword=self.keyword)
+        if not token:
+            return None
+
+        user = token_cache.get(token) or self.get_user(token)
+        if user is None:
+            return None
+        return user, token
+
+    async def aauthenticate(self, request):
+        """Same as ``authenticate``, but only leaves the event loop on a cache miss."""
+        token = get_bearer_token(request, keyword=self.keyword)
+        if not token:
+            return None
+
+        user = token_cache.get(token) or await sync_to_async(self.get_user)(token)
+        if user is None:
+            return None
+        return user, token
+
+    def get_user(self, token):
+        # read before the token, so a revocation committed meanwhile changes it
+        token_version = caching.get_versions([caching.token_key(ApiToken.hash_key(token))])[0]
+        api_token = ApiToken.get_valid(token)
+        if api_token is None:
+            return None
+        versions = [token_version] + caching.get_versions([caching.user_key(api_token.user_id)])
+        # never serve a token from the cache after it has expired
+        token_cache.set(token, api_token.user, versions,
+                        ttl=(api_token.expires_at - timezone.now()).total_seconds())
+        return api_token.user
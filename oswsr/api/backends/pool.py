@@ -0,0 +1,178 @@
+import threading
+import time
+from functools import partial
+
+from django.db.utils import OperationalError
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Per-process pool of raw DB-API connections.
+
+    At most ``max_size`` connections are open at a time; a checkout waits up
+    to ``timeout`` seconds for one to be returned. Connections older than
+    ``max_age`` seconds are closed instead of reused, and with
+    ``health_checks`` every reused connection is pinged on checkout. A
+    closed pool closes the connections given back to it.
+    """
+
+    def __init__(self, max_size=10, max_age=None, health_checks=True, timeout=10):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.health_checks = health_checks
+        self.timeout = timeout
+        self._idle = []
+        self._created = {}
+        self._in_use = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._stats = {'created': 0, 'reused': 0, 'discarded': 0, 'waits': 0, 'timeouts': 0}
+
+    def checkout(self, factory):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._condition:
+                connection = self._acquire(deadline)
+            if connection is None:
+                try:
+                    connection = factory()
+                except Exception:
+                    self._release()
+                    raise
+                with self._condition:
+                    self._created[id(connection)] = time.monotonic()
+                    self._stats['created'] += 1
+                return connection
+            if self.is_usable(connection):
+                with self._condition:
+                    self._stats['reused'] += 1
+                return connection
+            self._discard(connection)
+            self._release()
+
+    def checkin(self, connection):
+        try:
+            connection.rollback()
+        except Exception:
+            self._discard(connection)
+        else:
+            with self._condition:
+                if self._closed or self._is_obsolete(connection):
+                    self._close(connection)
+                else:
+                    self._idle.append(connection)
+        self._release()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            self._discard(connection)
+
+    def stats(self):
+        with self._condition:
+            return dict(self._stats, max_size=self.max_size, in_use=self._in_use, idle=len(self._idle))
+
+    def is_usable(self, connection):
+        if not self.health_checks:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def _acquire(self, deadline):
+        """Reserves a slot and returns an idle connection, or None if a new one has to be opened."""
+        while True:
+            while self._idle:
+                connection = self._idle.pop()
+                if not self._is_obsolete(connection):
+                    self._in_use += 1
+                    return connection
+                self._close(connection)
+            if self._in_use < self.max_size:
+                self._in_use += 1
+                return None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._stats['timeouts'] += 1
+                raise PoolTimeout('No database connection available within %s seconds' % self.timeout)
+            self._stats['waits'] += 1
+            self._condition.wait(remaining)
+
+    def _release(self):
+        with self._condition:
+            self._in_use -= 1
+            self._condition.notify()
+
+    def _is_obsolete(self, connection):
+        created = self._created.get(id(connection), 0)
+        return self.max_age is not None and time.monotonic() - created > self.max_age
+
+    def _discard(self, connection):
+        with self._condition:
+            self._close(connection)
+
+    def _close(self, connection):
+        self._created.pop(id(connection), None)
+        self._stats['discarded'] += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+pools = {}
+pool_databases = {}
+pools_lock = threading.Lock()
+
+
+def get_database(settings_dict):
+    return tuple(settings_dict.get(name) for name in ('NAME', 'HOST', 'PORT', 'USER'))
+
+
+def get_pool(alias, settings_dict):
+    """Returns the pool of the alias, a new one once the alias points to another database."""
+    database = get_database(settings_dict)
+    with pools_lock:
+        if alias in pools and pool_databases[alias] != database:
+            # e.g. the test runner switched NAME to the test database
+            pools.pop(alias).close()
+        if alias not in pools:
+            options = settings_dict.get('POOL', {})
+            pools[alias] = ConnectionPool(max_size=options.get('MAX_SIZE', 10),
+                                          max_age=options.get('MAX_AGE'),
+                                          health_checks=options.get('HEALTH_CHECKS', True),
+                                          timeout=options.get('TIMEOUT', 10))
+            pool_databases[alias] = database
+        return pools[alias]
+
+
+def get_pool_stats():
+    with pools_lock:
+        return {alias: pool.stats() for alias, pool in pools.items()}
+
+
+class PooledDatabaseWrapperMixin:
+    """Takes connections from the alias' pool and gives them back to the same pool on close."""
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict)
+
+    def get_new_connection(self, conn_params):
+        self._connection_pool = self.pool
+        return self._connection_pool.checkout(partial(super().get_new_connection, conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                return self._connection_pool.checkin(self.connection)
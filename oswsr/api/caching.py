@@ -0,0 +1,83 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import routers
+
+USERS = 'users'
+WORK_SHIFTS = 'work-shifts'
+REFERENCE = 'reference'
+
+
+def get_cache():
+    return caches[getattr(settings, 'API_RESPONSE_CACHE', 'default')]
+
+
+def work_shift_key(work_shift_id):
+    return 'work-shift:%s' % work_shift_id
+
+
+def token_key(key_hash):
+    return 'token:%s' % key_hash
+
+
+def user_key(user_id):
+    return 'user:%s' % user_id
+
+
+def get_versions(keys):
+    cache = get_cache()
+    version_keys = ['version:%s' % key for key in keys]
+    versions = cache.get_many(version_keys)
+    missing = {key: uuid.uuid4().hex for key in version_keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in version_keys]
+
+
+def bump_versions(keys):
+    """Changes the versions of the resources once the current transaction commits."""
+    keys = list(keys)
+    if not keys:
+        return
+
+    def bump():
+        cache = get_cache()
+        cache.set_many({'version:%s' % key: uuid.uuid4().hex for key in keys}, timeout=None)
+        # marks the resources as changed until the read replicas caught up
+        cache.set_many({'changed:%s' % key: True for key in keys},
+                       timeout=getattr(settings, 'API_DATABASE_STICKY_SECONDS', 5))
+
+    transaction.on_commit(bump)
+
+
+def conditional_response(request, keys, build):
+    """
+    Answers a GET with an ETag derived from the versions of ``keys``.
+
+    A matching ``If-None-Match`` gets a 304 and a known ETag is answered from
+    the response cache, both without touching the ORM. Otherwise ``build()``
+    computes the data, which is cached under the new ETag.
+    """
+    versions = get_versions(keys)
+    digest = hashlib.sha1('|'.join([request.get_full_path()] + versions).encode()).hexdigest()
+    etag = '"%s"' % digest
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    if etag in [value.strip() for value in if_none_match.split(',')]:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+    cache = get_cache()
+    data = cache.get('response:%s' % digest)
+    if data is None:
+        # a lagging replica must not fill the cache under the new version
+        routers.use_primary_if_changed(keys)
+        data = build()
+        cache.set('response:%s' % digest, data)
+    return Response(data, headers={'ETag': etag})
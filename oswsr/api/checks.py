@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+PROCESS_LOCAL_CACHES = [
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+]
+
+
+@register(Tags.caches)
+def check_api_cache(app_configs, **kwargs):
+    """The ETag versions and the reference data version only reach other workers through a shared cache."""
+    alias = getattr(settings, 'API_RESPONSE_CACHE', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        'The api cache "%s" is not shared between processes.' % alias,
+        hint='Writes handled by one worker do not invalidate the cached responses and reference data of the '
+             'others. Use a FileBasedCache, Redis or Memcached backend for it.',
+        id='api.W001',
+    )]
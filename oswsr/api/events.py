@@ -0,0 +1,112 @@
+"""
+In-process broadcast of order events to the live order feed.
+
+Model signals publish an event once the transaction commits. The hub hands
+it to every subscriber of the work shift through the subscriber's event
+loop. Each subscriber has a bounded queue: a client that does not keep up
+is dropped when its queue is full, and publishing never waits for a client.
+"""
+import asyncio
+import itertools
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Order
+from .renderers import JSONRenderer
+from .serializers import OrderValuesSerializer
+
+ORDER_CREATED = 'order.created'
+ORDER_UPDATED = 'order.updated'
+ORDER_DELETED = 'order.deleted'
+WORK_SHIFT_CLOSED = 'work_shift.closed'
+
+# put in the queue of a dropped subscriber, ends its stream
+DROPPED = object()
+
+
+class Subscriber:
+
+    def __init__(self, loop, work_shift_id, max_size):
+        self.loop = loop
+        self.work_shift_id = work_shift_id
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.dropped = False
+
+    def offer(self, event):
+        # runs on the subscriber's event loop
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(DROPPED)
+
+
+class EventHub:
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    @property
+    def queue_size(self):
+        return getattr(settings, 'API_EVENTS_QUEUE_SIZE', 100)
+
+    def subscribe(self, work_shift_id):
+        """Registers a subscriber on the running event loop."""
+        subscriber = Subscriber(asyncio.get_running_loop(), work_shift_id, self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def has_subscribers(self, work_shift_id=None):
+        with self._lock:
+            return any(work_shift_id is None or subscriber.work_shift_id == work_shift_id
+                       for subscriber in self._subscribers)
+
+    def publish(self, work_shift_id, event_type, data):
+        """Encodes the event once as a Server-Sent Events frame and offers it to the shift's subscribers."""
+        with self._lock:
+            subscribers = [subscriber for subscriber in self._subscribers
+                           if subscriber.work_shift_id == work_shift_id and not subscriber.dropped]
+        if not subscribers:
+            return
+        frame = b'id: %d\nevent: %s\ndata: %s\n\n' % (next(self._ids), event_type.encode(),
+                                                    JSONRenderer().render(data))
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, frame)
+            except RuntimeError:
+                # the loop of a disconnected client is already closed
+                self.unsubscribe(subscriber)
+
+
+hub = EventHub()
+
+
+def publish_order(event_type, order_id):
+    """Publishes the order in the report shape once the current transaction commits."""
+
+    def publish():
+        if not hub.has_subscribers():
+            return
+        serializer = OrderValuesSerializer()
+        row = serializer.values(Order.objects.filter(id=order_id), 'shift_worker__work_shift_id').first()
+        if row is not None:
+            hub.publish(row['shift_worker__work_shift_id'], event_type, serializer.to_representation(row))
+
+    transaction.on_commit(publish)
+
+
+def publish_event(work_shift_id, event_type, data):
+    transaction.on_commit(lambda: hub.publish(work_shift_id, event_type, data))
@@ -1,4 +1,5 @@
-from rest_framework.exceptions import APIException
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
 from rest_framework.response import Response
 
 
@@ -15,6 +16,14 @@ class CafeAPIException(APIException):
         self.detail = response
 
 
+class CafeThrottledException(CafeAPIException):
+
+    def __init__(self, wait=None):
+        super().__init__(message='Too many requests', code=status.HTTP_429_TOO_MANY_REQUESTS)
+        # DRF sets the Retry-After header from it
+        self.wait = wait
+
+
 class CafeValidationAPIException(APIException):
 
     def __init__(self, message=None, code=None, errors=None):
@@ -27,3 +36,13 @@ class CafeValidationAPIException(APIException):
             }
         }
         self.detail = response
+
+
+def exception_handler(exc, context):
+    """DRF's exception handler, which answers throttled requests in the api error format."""
+    # rest_framework.views loads the throttle classes, which import this module
+    from rest_framework import views
+
+    if isinstance(exc, Throttled):
+        exc = CafeThrottledException(exc.wait)
+    return views.exception_handler(exc, context)
@@ -0,0 +1,76 @@
+import csv
+
+from rest_framework import serializers
+
+from .reference import reference_data
+from .renderers import JSONRenderer
+
+
+class Echo:
+    """File-like object that hands the written csv line back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+class OrderExport:
+    """
+    Streams orders as NDJSON or CSV lines.
+
+    Orders are read in keyset batches of ``chunk_size`` rows, so memory stays
+    bounded even on backends that buffer whole result sets (MySQL).
+    """
+
+    fields = ['id', 'work_shift', 'table', 'shift_workers', 'number_of_person', 'create_at', 'status', 'price']
+    content_types = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+    chunk_size = 2000
+    datetime_field = serializers.DateTimeField()
+
+    def __init__(self, orders):
+        self.orders = orders.values('id', 'shift_worker__work_shift_id', 'table_id', 'shift_worker__user__name',
+                                    'number_of_person', 'created_at', 'status_order_id', 'total_price')
+
+    @classmethod
+    def filter_orders(cls, orders, params):
+        """Applies the validated ``OrderExportSerializer`` range to the orders."""
+        if 'start' in params:
+            orders = orders.filter(created_at__gte=params['start'])
+        if 'end' in params:
+            orders = orders.filter(created_at__lt=params['end'])
+        return orders
+
+    def rows(self):
+        last_id = 0
+        while True:
+            chunk = list(self.orders.filter(id__gt=last_id).order_by('id')[:self.chunk_size])
+            for row in chunk:
+                yield {
+                    'id': row['id'],
+                    'work_shift': row['shift_worker__work_shift_id'],
+                    'table': reference_data.get('tables', row['table_id']).name,
+                    'shift_workers': row['shift_worker__user__name'],
+                    'number_of_person': row['number_of_person'],
+                    'create_at': self.datetime_field.to_representation(row['created_at']),
+                    'status': reference_data.get('statuses', row['status_order_id']).name,
+                    'price': 0 if row['total_price'] is None else row['total_price'],
+                }
+            if len(chunk) < self.chunk_size:
+                return
+            last_id = chunk[-1]['id']
+
+    def ndjson(self):
+        renderer = JSONRenderer()
+        for row in self.rows():
+            yield renderer.render(row) + b'\n'
+
+    def csv(self):
+        writer = csv.DictWriter(Echo(), fieldnames=self.fields)
+        yield writer.writeheader()
+        for row in self.rows():
+            yield writer.writerow(row)
+
+    def stream(self, export_type):
+        return getattr(self, export_type)()
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.crypto import get_random_string
+from rest_framework import serializers
+from rest_framework.utils.encoders import JSONEncoder
+
+from .analytics import RevenueReport
+from .exports import OrderExport
+from .models import Order, ReportJob
+from .renderers import JSONRenderer
+from .serializers import OrderExportSerializer, RevenueAnalyticsSerializer
+
+logger = logging.getLogger(__name__)
+
+
+class ReportStorage(FileSystemStorage):
+    """Report files, kept outside the media root and only served through the api."""
+
+    @property
+    def base_location(self):
+        return getattr(settings, 'API_REPORTS_ROOT', os.path.join(settings.BASE_DIR.parent, 'reports'))
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+report_storage = ReportStorage()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class OrdersReportSerializer(OrderExportSerializer):
+    work_shift_id = serializers.IntegerField(required=False)
+
+
+class OrdersJob:
+    """All orders, or the orders of one shift, as an NDJSON or CSV file."""
+    serializer_class = OrdersReportSerializer
+
+    def get_extension(self, params):
+        return params['type']
+
+    def write(self, job, params, file):
+        orders = Order.objects.all()
+        if 'work_shift_id' in params:
+            orders = orders.filter(shift_worker__work_shift_id=params['work_shift_id'])
+        orders = OrderExport.filter_orders(orders, params)
+        total = orders.count()
+
+        export = OrderExport(orders)
+        for index, line in enumerate(export.stream(params['type'])):
+            file.write(line.encode() if isinstance(line, str) else line)
+            if index % export.chunk_size == 0 and not job.set_progress(min(99, index * 100 // max(total, 1))):
+                raise JobCancelled()
+
+
+class RevenueJob:
+    """The revenue analytics as a JSON file."""
+    serializer_class = RevenueAnalyticsSerializer
+
+    def get_extension(self, params):
+        return 'json'
+
+    def write(self, job, params, file):
+        data = RevenueReport(**params).data
+        # the report is computed by a few grouped queries, the heartbeat follows them
+        if not job.set_progress(90):
+            raise JobCancelled()
+        file.write(JSONRenderer().render({'data': data}))
+
+
+REPORTS = {
+    ReportJob.ORDERS: OrdersJob(),
+    ReportJob.REVENUE: RevenueJob(),
+}
+
+
+def validate_params(kind, params):
+    """Returns the validated parameters and the key that identifies identical reports."""
+    serializer = REPORTS[kind].serializer_class(data=params)
+    serializer.is_valid(raise_exception=True)
+    normalized = json.dumps([kind, serializer.validated_data], cls=JSONEncoder, sort_keys=True)
+    return serializer.validated_data, hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def run_job(job):
+    """Writes the report file of a claimed job and records the outcome."""
+    report = REPORTS[job.kind]
+    name = None
+    try:
+        params, _ = validate_params(job.kind, job.params)
+        # a file per attempt, so a requeued run never deletes the file of the next one
+        name = 'report-job-%d-%s.%s' % (job.id, get_random_string(8), report.get_extension(params))
+        os.makedirs(report_storage.location, exist_ok=True)
+        with open(report_storage.path(name), 'wb') as file:
+            report.write(job, params, file)
+        if job.finish(ReportJob.DONE, file_name=name):
+            return
+    except JobCancelled:
+        pass
+    except Exception as exc:
+        logger.exception('Report job %d failed', job.id)
+        job.finish(ReportJob.FAILED, error=str(exc))
+    # cancelled or failed, the partial file is of no use
+    if name is not None and report_storage.exists(name):
+        report_storage.delete(name)
@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.archive import archive_shifts, get_archivable_shifts
+
+
+class Command(BaseCommand):
+    help = 'Moves the orders of closed shifts past the retention window into compressed shift archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int,
+                            default=getattr(settings, 'API_ARCHIVE_RETENTION_DAYS', 90),
+                            help='Archive shifts that ended more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=50, help='Shifts archived per transaction')
+        parser.add_argument('--interval', type=float,
+                            help='Keep running and archive every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            self.archive(options['retention_days'], max(options['batch_size'], 1))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
+
+    def archive(self, retention_days, batch_size):
+        shifts = orders = 0
+        while True:
+            work_shift_ids = list(get_archivable_shifts(retention_days).order_by('id')
+                                  .values_list('id', flat=True)[:batch_size])
+            if not work_shift_ids:
+                break
+            archived, archived_orders = archive_shifts(work_shift_ids)
+            shifts += len(archived)
+            orders += archived_orders
+        self.stdout.write('Archived %d shifts with %d orders' % (shifts, orders))
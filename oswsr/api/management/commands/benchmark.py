@@ -0,0 +1,218 @@
+import json
+import statistics
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework import renderers
+
+from api import caching
+from api.jobs import report_storage, run_job
+from api.models import ApiToken, User, WorkShift, ShiftWorker, Table, Menu, Status, Order, OrderMenu, ReportJob
+from api.reference import reference_data
+from api.renderers import JSONRenderer
+from api.reports import ShiftOrdersReport
+from api.throttling import bucket_store
+
+
+class Command(BaseCommand):
+    help = 'Measures latency percentiles and query counts of the api endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, help='Seed synthetic data at this scale before measuring')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', help='Fail if results regress against this JSON file')
+        parser.add_argument('--tolerance', type=float, default=1.5,
+                            help='Allowed p95 latency ratio against the baseline')
+
+    def handle(self, *args, **options):
+        # allows the test client's "testserver" host
+        with override_settings(ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+            self.run_benchmark(options)
+
+    def run_benchmark(self, options):
+        if options['scale']:
+            call_command('seed_cafe', scale=options['scale'], stdout=self.stdout)
+
+        admin = User.objects.filter(role__code='admin').first()
+        work_shift = WorkShift.objects.order_by('-id').first()
+        if admin is None or work_shift is None:
+            raise CommandError('No data to benchmark, run with --scale or seed_cafe first')
+        token = ApiToken.issue(admin, device='benchmark')
+        user_ids = list(User.objects.exclude(work_shifts=work_shift).values_list('id', flat=True)[:10])
+
+        results = {}
+        # the order and report job the scenarios act on are rolled back after the run
+        with transaction.atomic():
+            order, job = self.create_fixtures(admin, work_shift)
+            for name, method, path, data, *setup in self.get_scenarios(admin, work_shift, user_ids, order, job):
+                results[name] = self.measure(method, path, data, token, options['iterations'], *setup)
+                self.stdout.write('%-28s p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms  %4d queries  HTTP %d' % (
+                    name, results[name]['p50'], results[name]['p95'], results[name]['p99'],
+                    results[name]['queries'], results[name]['status']))
+            transaction.set_rollback(True)
+        if job.file_name:
+            report_storage.delete(job.file_name)
+        ApiToken.revoke(token)
+
+        renderers = self.measure_renderers(options['iterations'])
+        for name, result in renderers.items():
+            self.stdout.write('%-28s p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms  %d bytes' % (
+                name, result['p50'], result['p95'], result['p99'], result['bytes']))
+
+        report = {
+            'scale': options['scale'],
+            'iterations': options['iterations'],
+            'results': results,
+            'renderers': renderers,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = self.compare(json.load(baseline)['results'], results, options['tolerance'])
+            if regressions:
+                for message in regressions:
+                    self.stderr.write(message)
+                raise CommandError('%d endpoints regressed' % len(regressions))
+
+    def create_fixtures(self, admin, work_shift):
+        """An order of the admin with five positions and a finished revenue report job."""
+        shift_worker, _ = ShiftWorker.objects.get_or_create(user=admin, work_shift=work_shift)
+        order = Order.objects.create(shift_worker=shift_worker, table_id=Table.objects.values_list('id', flat=True)[0],
+                                     number_of_person=2, status_order=Status.objects.get(code='taken'),
+                                     created_at=timezone.now())
+        OrderMenu.objects.bulk_create([OrderMenu(order=order, menu_id=menu_id, quantity=1)
+                                       for menu_id in Menu.objects.values_list('id', flat=True)[:5]])
+        job = ReportJob.objects.create(user=admin, kind=ReportJob.REVENUE, params={'group_by': 'day'},
+                                       status=ReportJob.RUNNING)
+        run_job(job)
+        job.refresh_from_db()
+        return order, job
+
+    def get_scenarios(self, admin, work_shift, user_ids, order, job):
+        shift = '/api-cafe/work-shift/%d' % work_shift.id
+        table_id = Table.objects.values_list('id', flat=True).first()
+        menu_ids = list(Menu.objects.values_list('id', flat=True)[:5])
+        position_ids = list(OrderMenu.objects.filter(order=order).values_list('id', flat=True))
+        return [
+            ('login', 'post', '/api-cafe/login', {'login': admin.login, 'password': admin.password}),
+            ('logout', 'get', '/api-cafe/logout', None),
+            ('user list', 'get', '/api-cafe/user', None),
+            ('user list fields', 'get', '/api-cafe/user?fields=id,group', None),
+            ('user create', 'post', '/api-cafe/user',
+             {'login': 'benchmark', 'password': 'secret', 'role_id': admin.role_id}),
+            ('user import', 'post', '/api-cafe/user/import',
+             [{'login': 'benchmark%d' % i, 'password': 'secret', 'role_id': admin.role_id} for i in range(100)]),
+            ('db pool', 'get', '/api-cafe/db-pool', None),
+            ('work shift create', 'post', '/api-cafe/work-shift',
+             {'start': '2100-01-01 08:00', 'end': '2100-01-01 16:00'}),
+            ('work shift open', 'get', shift + '/open', None),
+            ('work shift close', 'get', shift + '/close', None, partial(self.activate, work_shift)),
+            ('work shift user', 'post', shift + '/user', {'user_id': user_ids[0] if user_ids else admin.id}),
+            ('work shift users', 'post', shift + '/users', {'user_ids': user_ids or [admin.id]}),
+            ('work shift bulk users', 'post', '/api-cafe/work-shift/users',
+             {'workers': [{'work_shift_id': work_shift.id, 'user_id': user_id} for user_id in user_ids]}),
+            ('work shift orders', 'get', shift + '/order', None),
+            ('work shift export', 'get', shift + '/order/export', None),
+            ('orders export', 'get', '/api-cafe/work-shift/order/export?type=csv', None),
+            ('order create', 'post', '/api-cafe/order',
+             {'table_id': table_id, 'number_of_person': 2,
+              'items': [{'menu_id': menu_id, 'quantity': 2} for menu_id in menu_ids]},
+             partial(self.join_shift, admin, work_shift)),
+            ('order position add', 'post', '/api-cafe/order/%d/position' % order.id,
+             {'items': [{'menu_id': menu_id, 'quantity': 1} for menu_id in menu_ids]}),
+            ('order position delete', 'delete', '/api-cafe/order/%d/position' % order.id,
+             {'position_ids': position_ids}),
+            ('revenue by day', 'get', '/api-cafe/analytics/revenue?group_by=day', None),
+            ('revenue by menu', 'get', '/api-cafe/analytics/revenue?group_by=menu', None),
+            ('report job create', 'post', '/api-cafe/report-job', {'kind': 'revenue', 'params': {'group_by': 'menu'}}),
+            ('report job status', 'get', '/api-cafe/report-job/%d' % job.id, None),
+            ('report job download', 'get', '/api-cafe/report-job/%d/download' % job.id, None),
+            ('async user list', 'get', '/api-cafe/async/user', None),
+            ('async work shift orders', 'get', '/api-cafe/async/work-shift/%d/order' % work_shift.id, None),
+        ]
+
+    def activate(self, work_shift):
+        WorkShift.objects.filter(active=True).update(active=False)
+        WorkShift.objects.filter(pk=work_shift.pk).update(active=True)
+
+    def join_shift(self, user, work_shift):
+        self.activate(work_shift)
+        ShiftWorker.objects.get_or_create(user=user, work_shift=work_shift)
+
+    def measure(self, method, path, data, token, iterations, setup=None):
+        client = Client(HTTP_AUTHORIZATION='Bearer %s' % token)
+        latencies = []
+        for _ in range(iterations):
+            # measure the full cost, not the ETag response cache
+            caching.get_cache().clear()
+            # the cache also held the reference data version
+            reference_data.load()
+            # throttling is measured, but never rejects the repeated requests
+            bucket_store.clear()
+            # every request is rolled back, so writes can be repeated
+            with transaction.atomic():
+                if setup is not None:
+                    setup()
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    if data is None:
+                        response = getattr(client, method)(path)
+                    else:
+                        response = getattr(client, method)(path, json.dumps(data), content_type='application/json')
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                transaction.set_rollback(True)
+
+        return dict(
+            self.get_percentiles(latencies),
+            # the first iteration also looks up the token
+            queries=len(context.captured_queries),
+            status=response.status_code,
+        )
+
+    def measure_renderers(self, iterations):
+        """Times rendering the largest shift report with the stdlib and the api JSON renderers."""
+        work_shift = WorkShift.objects.annotate(orders=Count('shift_workers__orders')).order_by('-orders').first()
+        data = {'data': ShiftOrdersReport(work_shift).data}
+        results = {}
+        for name, renderer in [('render stdlib json', renderers.JSONRenderer()),
+                               ('render api json', JSONRenderer())]:
+            latencies = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                content = renderer.render(data)
+                latencies.append((time.perf_counter() - started) * 1000)
+            results[name] = dict(self.get_percentiles(latencies), bytes=len(content))
+        return results
+
+    def get_percentiles(self, latencies):
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+        return {
+            'p50': percentiles[49],
+            'p95': percentiles[94],
+            'p99': percentiles[98],
+        }
+
+    def compare(self, baseline, results, tolerance):
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            if result['queries'] > baseline[name]['queries']:
+                regressions.append('%s: %d queries, baseline %d' % (name, result['queries'], baseline[name]['queries']))
+            if result['p95'] > baseline[name]['p95'] * tolerance:
+                regressions.append('%s: p95 %.2f ms, baseline %.2f ms' % (name, result['p95'], baseline[name]['p95']))
+        return regressions
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import ApiToken
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired api tokens in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--interval', type=int,
+                            help='Keep running and clean up every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = self.clear(options['batch_size'])
+            self.stdout.write('Deleted %d expired tokens' % deleted)
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def clear(self, batch_size):
+        deleted = 0
+        now = timezone.now()
+        while True:
+            ids = list(ApiToken.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += ApiToken.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings, setup_test_environment
+
+from api.throttling import bucket_store
+
+
+class Command(BaseCommand):
+    help = 'Compares the throughput of the sync and async read endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('token', help='api token of an admin user')
+        parser.add_argument('--work-shift', type=int, help='work shift id for the order report')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # allows the test clients' "testserver" host
+        setup_test_environment()
+        # both legs do the full work: no rate limits, and the ETag response
+        # cache of the sync endpoints always misses
+        caches = dict(settings.CACHES, loadtest={'BACKEND': 'django.core.cache.backends.dummy.DummyCache'})
+        rest_framework = dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={})
+        with override_settings(CACHES=caches, API_RESPONSE_CACHE='loadtest', REST_FRAMEWORK=rest_framework):
+            self.run_paths(options)
+
+    def run_paths(self, options):
+        paths = ['user']
+        if options['work_shift']:
+            paths.append('work-shift/%d/order' % options['work_shift'])
+
+        for path in paths:
+            sync_path = '/api-cafe/%s' % path
+            async_path = '/api-cafe/async/%s' % path
+            bucket_store.clear()
+            sync_rate = self.run_sync(sync_path, options)
+            bucket_store.clear()
+            async_rate = asyncio.run(self.run_async(async_path, options))
+            self.stdout.write('%-40s sync %8.1f req/s' % (sync_path, sync_rate))
+            self.stdout.write('%-40s async %7.1f req/s' % (async_path, async_rate))
+
+    def run_sync(self, path, options):
+        authorization = 'Bearer %s' % options['token']
+
+        def request(_):
+            response = Client().get(path, HTTP_AUTHORIZATION=authorization)
+            connections.close_all()
+            return response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            statuses = list(executor.map(request, range(options['requests'])))
+        self.check_statuses(path, statuses)
+        return len(statuses) / (time.perf_counter() - started)
+
+    async def run_async(self, path, options):
+        authorization = 'Bearer %s' % options['token']
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        client = AsyncClient()
+
+        async def request():
+            async with semaphore:
+                response = await client.get(path, authorization=authorization)
+                return response.status_code
+
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*[request() for _ in range(options['requests'])])
+        self.check_statuses(path, statuses)
+        return len(statuses) / (time.perf_counter() - started)
+
+    def check_statuses(self, path, statuses):
+        failed = [code for code in statuses if code != 200]
+        if failed:
+            self.stderr.write('%s: %d of %d requests failed' % (path, len(failed), len(statuses)))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import caching
+from api.models import WorkShift, Order
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the order and work shift price rollups and verifies them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only verify the rollups, do not rebuild them')
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            with transaction.atomic():
+                orders = Order.update_total_prices(Order.objects.all())
+                # archived shifts have no orders left, their rollup is all that remains
+                work_shifts = WorkShift.update_total_prices(WorkShift.objects.filter(archived_at__isnull=True))
+                caching.bump_versions([caching.WORK_SHIFTS])
+            self.stdout.write('Rebuilt %d orders and %d work shifts' % (orders, work_shifts))
+
+        mismatches = self.verify()
+        if mismatches:
+            for message in mismatches:
+                self.stderr.write(message)
+            raise CommandError('%d rollups are out of date' % len(mismatches))
+        self.stdout.write(self.style.SUCCESS('Rollups are consistent'))
+
+    def verify(self):
+        orders = Order.objects.annotate(expected=Order.get_total_price_subquery()) \
+            .values_list('id', 'total_price', 'expected')
+        work_shifts = WorkShift.objects.filter(archived_at__isnull=True) \
+            .annotate(expected=WorkShift.get_total_price_subquery()) \
+            .values_list('id', 'total_price', 'expected')
+
+        mismatches = []
+        for name, rows in [('Order', orders), ('WorkShift', work_shifts)]:
+            for pk, total_price, expected in rows.iterator():
+                if total_price != expected:
+                    mismatches.append('%s %d: total_price is %s, expected %s' % (name, pk, total_price, expected))
+        return mismatches
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import WorkShift, DailyRevenue
+
+
+class Command(BaseCommand):
+    help = 'Precomputes the daily revenue of closed shifts for the analytics'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Shifts rolled up per transaction')
+        parser.add_argument('--rebuild', action='store_true', help='Delete and recompute all rollups')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            # archived shifts have no orders left to recompute them from
+            DailyRevenue.objects.filter(work_shift__archived_at__isnull=True).delete()
+
+        work_shift_ids = list(WorkShift.objects.filter(active=False, end__lte=timezone.now(), archived_at__isnull=True)
+                              .exclude(id__in=DailyRevenue.objects.values('work_shift_id'))
+                              .values_list('id', flat=True))
+        rows = 0
+        batch_size = options['batch_size']
+        for index in range(0, len(work_shift_ids), batch_size):
+            with transaction.atomic():
+                rows += DailyRevenue.rollup(work_shift_ids[index:index + batch_size])
+        self.stdout.write('Rolled up %d shifts into %d rows' % (len(work_shift_ids), rows))
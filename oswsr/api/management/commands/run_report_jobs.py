@@ -0,0 +1,50 @@
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.jobs import run_job
+from api.models import ReportJob
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued report jobs on a bounded pool of worker threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'API_REPORT_WORKERS', 2))
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait for new jobs when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        name = '%s:%d' % (socket.gethostname(), os.getpid())
+        timeout = getattr(settings, 'API_REPORT_JOB_TIMEOUT', 300)
+        workers = max(options['workers'], 1)
+        running = set()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report-jobs') as executor:
+            while True:
+                ReportJob.requeue_stale(timeout)
+                while len(running) < workers:
+                    job = ReportJob.claim(name)
+                    if job is None:
+                        break
+                    self.stdout.write('Running report job %d (%s)' % (job.id, job.kind))
+                    running.add(executor.submit(self.run, job))
+
+                if running:
+                    _, running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                elif options['once']:
+                    return
+                else:
+                    time.sleep(options['poll_interval'])
+
+    def run(self, job):
+        try:
+            run_job(job)
+        finally:
+            # every worker thread has its own connection
+            connection.close()
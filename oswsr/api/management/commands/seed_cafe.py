@@ -0,0 +1,118 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api import caching
+from api.models import Role, User, WorkShift, ShiftWorker, Status, Table, Menu, Order, OrderMenu
+
+# rows at scale 1, shift workers, orders and order items are per parent row
+VOLUMES = {
+    'users': 20,
+    'tables': 10,
+    'menus': 30,
+    'work_shifts': 30,
+    'workers_per_shift': 5,
+    'orders_per_shift': 40,
+    'items_per_order': 3,
+}
+ROLES = [('Administrator', 'admin'), ('Waiter', 'waiter'), ('Cook', 'cook')]
+STATUSES = [('Accepted', 'taken'), ('Preparing', 'preparing'), ('Ready', 'ready'), ('Paid up', 'paid-up')]
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with synthetic cafe data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=1,
+                            help='Multiplies the number of users, tables, menus and shifts (1, 10, 100)')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        scale = options['scale']
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        with transaction.atomic():
+            counts = self.seed(scale)
+            caching.bump_versions([caching.USERS, caching.WORK_SHIFTS])
+        self.stdout.write(', '.join('%d %s' % (count, name) for name, count in counts.items()))
+
+    def bulk_create(self, model, objects):
+        return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def seed(self, scale):
+        rand = self.random
+        roles = [Role.objects.get_or_create(code=code, defaults={'name': name})[0] for name, code in ROLES]
+        statuses = [Status.objects.get_or_create(code=code, defaults={'name': name})[0] for name, code in STATUSES]
+
+        prefix = 'seed%d-%d' % (User.objects.count(), rand.randrange(10 ** 6))
+        self.bulk_create(User, [
+            User(name='User %d' % i, surname='Surname %d' % i, login='%s-user%d' % (prefix, i),
+                 password='password', role=roles[0] if i == 0 else rand.choice(roles[1:]))
+            for i in range(VOLUMES['users'] * scale)
+        ])
+        users = list(User.objects.filter(login__startswith=prefix).values_list('id', flat=True))
+
+        self.bulk_create(Table, [Table(name='%s Table %d' % (prefix, i), capacity=rand.choice([2, 4, 6]))
+                                 for i in range(VOLUMES['tables'] * scale)])
+        tables = list(Table.objects.filter(name__startswith=prefix).values_list('id', flat=True))
+
+        self.bulk_create(Menu, [Menu(name='%s Dish %d' % (prefix, i), description='Dish %d' % i,
+                                     price=rand.randrange(50, 1500) / 10)
+                                for i in range(VOLUMES['menus'] * scale)])
+        menus = list(Menu.objects.filter(name__startswith=prefix).values_list('id', flat=True))
+
+        # consecutive 8 hour shifts ending now, none of them active
+        now = timezone.now()
+        shift_count = VOLUMES['work_shifts'] * scale
+        first_shift = WorkShift.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        self.bulk_create(WorkShift, [
+            WorkShift(start=now - timedelta(hours=8 * (shift_count - i)),
+                      end=now - timedelta(hours=8 * (shift_count - i - 1)))
+            for i in range(shift_count)
+        ])
+        work_shifts = list(WorkShift.objects.filter(id__gt=first_shift).values_list('id', 'start'))
+
+        self.bulk_create(ShiftWorker, [
+            ShiftWorker(work_shift_id=work_shift_id, user_id=user_id)
+            for work_shift_id, _ in work_shifts
+            for user_id in rand.sample(users, min(VOLUMES['workers_per_shift'], len(users)))
+        ])
+        shift_workers = {}
+        for shift_worker_id, work_shift_id in ShiftWorker.objects.filter(work_shift_id__gt=first_shift) \
+                .values_list('id', 'work_shift_id'):
+            shift_workers.setdefault(work_shift_id, []).append(shift_worker_id)
+
+        first_order = Order.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        self.bulk_create(Order, [
+            Order(number_of_person=rand.randint(1, 6), table_id=rand.choice(tables),
+                  shift_worker_id=rand.choice(shift_workers[work_shift_id]),
+                  status_order=rand.choice(statuses),
+                  created_at=start + timedelta(minutes=rand.randrange(8 * 60)))
+            for work_shift_id, start in work_shifts
+            for _ in range(VOLUMES['orders_per_shift'])
+        ])
+        orders = list(Order.objects.filter(id__gt=first_order).values_list('id', flat=True))
+
+        self.bulk_create(OrderMenu, [
+            OrderMenu(order_id=order_id, menu_id=rand.choice(menus))
+            for order_id in orders
+            for _ in range(rand.randint(1, VOLUMES['items_per_order'] * 2 - 1))
+        ])
+
+        # bulk_create skips the signals that maintain the price rollups
+        Order.update_total_prices(Order.objects.filter(id__gt=first_order))
+        WorkShift.update_total_prices(WorkShift.objects.filter(id__gt=first_shift))
+
+        return {
+            'users': len(users),
+            'tables': len(tables),
+            'menus': len(menus),
+            'work shifts': len(work_shifts),
+            'orders': len(orders),
+            'order items': OrderMenu.objects.filter(order_id__gt=first_order).count(),
+        }
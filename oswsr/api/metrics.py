@@ -0,0 +1,190 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.decorators import api_view, permission_classes
+
+from .permissions import IsAdmin
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RouteMetrics:
+
+    def __init__(self):
+        self.requests = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.duration = 0.0
+        self.queries = 0
+        self.query_duration = 0.0
+        self.response_bytes = 0
+        self.over_budget = 0
+
+
+class MetricsRegistry:
+    """Per-process request metrics, keyed by URL route and method."""
+
+    def __init__(self):
+        self._routes = defaultdict(RouteMetrics)
+        self._lock = threading.Lock()
+
+    def observe(self, route, method, duration, queries, query_duration, response_bytes, over_budget):
+        with self._lock:
+            metrics = self._routes[(route, method)]
+            metrics.requests += 1
+            metrics.duration += duration
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    metrics.buckets[index] += 1
+            metrics.queries += queries
+            metrics.query_duration += query_duration
+            metrics.response_bytes += response_bytes
+            metrics.over_budget += over_budget
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+    def render(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = [
+                '# HELP api_request_duration_seconds Request latency.',
+                '# TYPE api_request_duration_seconds histogram',
+            ]
+            for (route, method), metrics in routes:
+                labels = 'route="%s",method="%s"' % (escape(route), method)
+                for bound, count in zip(LATENCY_BUCKETS, metrics.buckets):
+                    lines.append('api_request_duration_seconds_bucket{%s,le="%s"} %d' % (labels, bound, count))
+                lines.append('api_request_duration_seconds_bucket{%s,le="+Inf"} %d' % (labels, metrics.requests))
+                lines.append('api_request_duration_seconds_sum{%s} %f' % (labels, metrics.duration))
+                lines.append('api_request_duration_seconds_count{%s} %d' % (labels, metrics.requests))
+
+            counters = [
+                ('api_db_queries_total', 'SQL queries run by requests.', 'queries', '%d'),
+                ('api_db_query_duration_seconds_total', 'Time spent in SQL queries.', 'query_duration', '%f'),
+                ('api_response_size_bytes_total', 'Size of the response bodies.', 'response_bytes', '%d'),
+                ('api_query_budget_exceeded_total', 'Requests over the query budget.', 'over_budget', '%d'),
+            ]
+            for name, help_text, attribute, value_format in counters:
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s counter' % name)
+                for (route, method), metrics in routes:
+                    lines.append(('%s{route="%s",method="%s"} ' + value_format)
+                                 % (name, escape(route), method, getattr(metrics, attribute)))
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.duration += time.perf_counter() - started
+
+
+_query_counter = contextvars.ContextVar('api_query_counter', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    counter = _query_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    return counter(execute, sql, params, many, context)
+
+
+def install_query_counter(connection):
+    """
+    Counts the queries of a connection for the request in flight.
+
+    The counter of the request is found through its context, which
+    ``sync_to_async`` carries to the thread and connection of a sync view.
+    """
+    if count_query not in connection.execute_wrappers:
+        # first, so execute_wrapper() blocks still remove their own wrapper
+        connection.execute_wrappers.insert(0, count_query)
+
+
+class MetricsMiddleware:
+    """
+    Records latency, SQL queries and response size of every request.
+
+    Requests that run more than ``API_QUERY_BUDGET`` queries are logged as
+    warnings. Under ASGI the middleware stays async, the queries a view runs
+    through ``sync_to_async`` are still counted.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # tells Django the middleware is called as a coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        started = time.perf_counter()
+        token = _query_counter.set(counter)
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_counter.reset(token)
+        self.observe(request, response, counter, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        token = _query_counter.set(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_counter.reset(token)
+        self.observe(request, response, counter, time.perf_counter() - started)
+        return response
+
+    def observe(self, request, response, counter, duration):
+        resolver_match = request.resolver_match
+        route = resolver_match.route if resolver_match else 'unresolved'
+        query_budget = getattr(settings, 'API_QUERY_BUDGET', None)
+        over_budget = query_budget is not None and counter.queries > query_budget
+        if over_budget:
+            logger.warning('%s %s ran %d SQL queries, the budget is %d',
+                           request.method, request.path, counter.queries, query_budget)
+
+        response_bytes = 0 if response.streaming else len(response.content)
+        registry.observe(route, request.method, duration, counter.queries, counter.duration,
+                         response_bytes, over_budget)
+
+
+@api_view(['GET'])
+@permission_classes((IsAdmin,))
+def metrics(request):
+    """The metrics of this process for a scraper authenticated with an admin token."""
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
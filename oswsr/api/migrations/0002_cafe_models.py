@@ -0,0 +1,194 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:27
+
+import api.utilities
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Menu',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('description', models.CharField(max_length=255)),
+                ('price', models.FloatField()),
+            ],
+            options={
+                'db_table': 'menus',
+            },
+        ),
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number_of_person', models.IntegerField(blank=True)),
+                ('created_at', models.DateTimeField(blank=True)),
+                ('total_price', models.FloatField(blank=True, editable=False, null=True)),
+            ],
+            options={
+                'db_table': 'orders',
+            },
+        ),
+        migrations.CreateModel(
+            name='Role',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('code', models.CharField(max_length=50)),
+            ],
+            options={
+                'db_table': 'roles',
+            },
+        ),
+        migrations.CreateModel(
+            name='ShiftWorker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'db_table': 'shift_workers',
+            },
+        ),
+        migrations.CreateModel(
+            name='Status',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('code', models.CharField(max_length=100)),
+            ],
+            options={
+                'db_table': 'status_orders',
+            },
+        ),
+        migrations.CreateModel(
+            name='Table',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('capacity', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'tables',
+            },
+        ),
+        # role_id was a plain integer column, keep its values for the foreign key
+        migrations.RenameField(
+            model_name='user',
+            old_name='role_id',
+            new_name='role',
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='api_token',
+            field=models.CharField(blank=True, max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='last_login',
+            field=models.DateTimeField(blank=True, db_column='updated_at', null=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='login',
+            field=models.CharField(max_length=254, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='password',
+            field=models.CharField(max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='patronymic',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='photo_file',
+            field=models.ImageField(blank=True, max_length=254, null=True, upload_to=api.utilities.get_name_file, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['png', 'jpg', 'jpeg'])]),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='status',
+            field=models.CharField(choices=[('working', 'working'), ('fired', 'fired')], default='working', max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='surname',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.CreateModel(
+            name='WorkShift',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('active', models.BooleanField(blank=True, default=False)),
+                ('total_price', models.FloatField(blank=True, editable=False, null=True)),
+                ('workers', models.ManyToManyField(related_name='work_shifts', through='api.ShiftWorker', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'work_shifts',
+            },
+        ),
+        migrations.AddField(
+            model_name='shiftworker',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shift_workers', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='shiftworker',
+            name='work_shift',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shift_workers', to='api.workshift'),
+        ),
+        migrations.CreateModel(
+            name='OrderMenu',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('menu', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_menus', to='api.menu')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_menus', to='api.order')),
+            ],
+            options={
+                'db_table': 'order_menus',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='menu',
+            field=models.ManyToManyField(related_name='orders', through='api.OrderMenu', to='api.Menu'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='shift_worker',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='api.shiftworker'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='status_order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='api.status'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='table',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='api.table'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='role',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.role'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:28
+
+from django.db import migrations, models
+
+
+def create_single_active_index(apps, schema_editor):
+    # MySQL skips conditional unique constraints, a functional unique index
+    # (MySQL 8.0.13+) lets only one row have a non-NULL value instead.
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('CREATE UNIQUE INDEX work_shifts_single_active '
+                              'ON work_shifts ((CASE WHEN active THEN 1 END))')
+
+
+def drop_single_active_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('DROP INDEX work_shifts_single_active ON work_shifts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_cafe_models'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='api_token',
+            field=models.CharField(blank=True, db_index=True, max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='workshift',
+            name='active',
+            field=models.BooleanField(blank=True, db_index=True, default=False),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['shift_worker', 'created_at'], name='orders_worker_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workshift',
+            index=models.Index(fields=['start', 'end'], name='work_shifts_start_end_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='shiftworker',
+            constraint=models.UniqueConstraint(fields=('user', 'work_shift'), name='shift_workers_user_work_shift_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='workshift',
+            constraint=models.UniqueConstraint(condition=models.Q(('active', True)), fields=('active',), name='work_shifts_single_active'),
+        ),
+        migrations.RunPython(create_single_active_index, drop_single_active_index),
+    ]
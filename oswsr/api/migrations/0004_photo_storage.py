@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:29
+
+import api.photos
+import api.utilities
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='photo_file',
+            field=models.ImageField(blank=True, max_length=254, null=True, storage=api.photos.PhotoStorage(), upload_to=api.utilities.get_name_file, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['png', 'jpg', 'jpeg'])]),
+        ),
+    ]
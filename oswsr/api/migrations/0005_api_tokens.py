@@ -0,0 +1,52 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:30
+
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def copy_api_tokens(apps, schema_editor):
+    # keep the current sessions logged in
+    User = apps.get_model('api', 'User')
+    ApiToken = apps.get_model('api', 'ApiToken')
+    alias = schema_editor.connection.alias
+    expires_at = timezone.now() + timedelta(seconds=getattr(settings, 'API_TOKEN_LIFETIME', 30 * 24 * 60 * 60))
+    tokens = [
+        ApiToken(user_id=user_id, key_hash=hashlib.sha256(api_token.encode()).hexdigest(), expires_at=expires_at)
+        for user_id, api_token in User.objects.using(alias).exclude(api_token='').exclude(api_token__isnull=True)
+        .values_list('id', 'api_token').iterator()
+    ]
+    ApiToken.objects.using(alias).bulk_create(tokens, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_photo_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key_hash', models.CharField(max_length=64, unique=True)),
+                ('device', models.CharField(blank=True, max_length=254)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='api_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'api_tokens',
+            },
+        ),
+        migrations.RunPython(copy_api_tokens, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='user',
+            name='api_token',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_api_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordermenu',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
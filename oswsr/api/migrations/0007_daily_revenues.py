@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_order_menu_quantity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('revenue', models.FloatField(default=0)),
+                ('orders', models.IntegerField(default=0)),
+                ('covers', models.IntegerField(default=0)),
+                ('table', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_revenues', to='api.table')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_revenues', to=settings.AUTH_USER_MODEL)),
+                ('work_shift', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_revenues', to='api.workshift')),
+            ],
+            options={
+                'db_table': 'daily_revenues',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dailyrevenue',
+            index=models.Index(fields=['date'], name='daily_revenues_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyrevenue',
+            constraint=models.UniqueConstraint(fields=('date', 'work_shift', 'table', 'user'), name='daily_revenues_uniq'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_report_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShiftArchive',
+            fields=[
+                ('work_shift', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='api.workshift')),
+                ('orders', models.BinaryField()),
+                ('order_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'work_shift_archives',
+            },
+        ),
+        migrations.AddField(
+            model_name='workshift',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
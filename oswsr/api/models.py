@@ -1,9 +1,18 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.core.validators import FileExtensionValidator
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from django.utils.crypto import get_random_string
 from django.contrib.auth.base_user import BaseUserManager
-from rest_framework.authentication import get_authorization_header
 
+from . import caching
+from .photos import photo_storage
 from .utilities import get_name_file
 
 
@@ -21,10 +30,9 @@ class User(AbstractBaseUser):
     patronymic = models.CharField(max_length=100, blank=True)
     login = models.CharField(max_length=254, unique=True)
     password = models.CharField(max_length=254, blank=False)
-    photo_file = models.ImageField(max_length=254, upload_to=get_name_file,
+    photo_file = models.ImageField(max_length=254, upload_to=get_name_file, storage=photo_storage,
                                    blank=True, null=True,
                                    validators=[FileExtensionValidator(allowed_extensions=['png', 'jpg', 'jpeg'])])
-    api_token = models.CharField(max_length=254, blank=True)
     status = models.CharField(max_length=254, choices=[('working', 'working'), ('fired', 'fired')], default='working')
     last_login = models.DateTimeField(db_column='updated_at', blank=True, null=True)
     role = models.ForeignKey(Role, on_delete=models.CASCADE)
@@ -32,22 +40,59 @@ class User(AbstractBaseUser):
     USERNAME_FIELD = 'login'
     objects = BaseUserManager()
 
+    class Meta:
+        db_table = 'users'
+
+
+class ApiToken(models.Model):
+    """
+    Login session of a user. Only the sha256 of the token is stored, and a user
+    can have a token per device.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens')
+    key_hash = models.CharField(max_length=64, unique=True)
+    device = models.CharField(max_length=254, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    @staticmethod
+    def hash_key(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def issue(cls, user, device=''):
+        """Creates a token for the user and returns the raw key, which is not stored."""
+        key = get_random_string(length=32)
+        lifetime = timedelta(seconds=getattr(settings, 'API_TOKEN_LIFETIME', 30 * 24 * 60 * 60))
+        cls.objects.create(user=user, key_hash=cls.hash_key(key), device=device,
+                           expires_at=timezone.now() + lifetime)
+        return key
+
     @classmethod
-    def get_auth_user(cls, request=None):
-        keyword = 'Bearer'
-        auth = get_authorization_header(request).split()
-        if not auth or auth[0].lower() != keyword.lower().encode() or not auth[1]:
-            return None
-        return cls.objects.filter(api_token=auth[1].decode()).first()
+    def get_valid(cls, key):
+        return cls.objects.select_related('user') \
+            .filter(key_hash=cls.hash_key(key), expires_at__gt=timezone.now()) \
+            .first()
+
+    @classmethod
+    def revoke(cls, key):
+        """Deletes the token, the workers that cached it drop it when its version changes."""
+        key_hash = cls.hash_key(key)
+        caching.bump_versions([caching.token_key(key_hash)])
+        return cls.objects.filter(key_hash=key_hash).delete()
 
     class Meta:
-        db_table = 'users'
+        db_table = 'api_tokens'
 
 
 class WorkShift(models.Model):
     start = models.DateTimeField(blank=False)
     end = models.DateTimeField(blank=False)
-    active = models.BooleanField(blank=True, default=False)
+    active = models.BooleanField(blank=True, default=False, db_index=True)
+    # Sum of Order.total_price, NULL while no order has a price
+    total_price = models.FloatField(blank=True, null=True, editable=False)
+    # Set once archive_shifts moved the orders to a ShiftArchive
+    archived_at = models.DateTimeField(blank=True, null=True, editable=False)
     workers = models.ManyToManyField(User, through='ShiftWorker', related_name='work_shifts')
 
     def get_orders(self):
@@ -57,8 +102,31 @@ class WorkShift(models.Model):
             data += orders
         return data
 
+    def get_price(self):
+        return 0 if self.total_price is None else self.total_price
+
+    @classmethod
+    def get_total_price_subquery(cls):
+        orders = Order.objects.filter(shift_worker__work_shift=OuterRef('pk')) \
+            .values('shift_worker__work_shift') \
+            .annotate(total=Sum('total_price')) \
+            .values('total')
+        return Subquery(orders)
+
+    @classmethod
+    def update_total_prices(cls, work_shifts):
+        return work_shifts.update(total_price=cls.get_total_price_subquery())
+
     class Meta:
         db_table = 'work_shifts'
+        indexes = [
+            models.Index(fields=['start', 'end'], name='work_shifts_start_end_idx'),
+        ]
+        constraints = [
+            # MySQL ignores conditions, migration 0003 adds a functional unique index there
+            models.UniqueConstraint(fields=['active'], condition=models.Q(active=True),
+                                    name='work_shifts_single_active'),
+        ]
 
 
 class ShiftWorker(models.Model):
@@ -67,6 +135,9 @@ class ShiftWorker(models.Model):
 
     class Meta:
         db_table = 'shift_workers'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'work_shift'], name='shift_workers_user_work_shift_uniq'),
+        ]
 
 
 class Status(models.Model):
@@ -100,21 +171,190 @@ class Order(models.Model):
     shift_worker = models.ForeignKey(ShiftWorker, on_delete=models.CASCADE, related_name='orders')
     status_order = models.ForeignKey(Status, on_delete=models.CASCADE, related_name='orders')
     created_at = models.DateTimeField(blank=True)
+    # Sum of the menu prices times the quantities, NULL while the order has no items
+    total_price = models.FloatField(blank=True, null=True, editable=False)
     menu = models.ManyToManyField(Menu, through='OrderMenu', related_name='orders')
 
     def get_price(self):
-        price = 0
-        for menu in self.menu.all():
-            price += menu.price
-        return price
+        return 0 if self.total_price is None else self.total_price
+
+    @classmethod
+    def get_total_price_subquery(cls):
+        order_menus = OrderMenu.objects.filter(order=OuterRef('pk')) \
+            .values('order') \
+            .annotate(total=Sum(F('menu__price') * F('quantity'))) \
+            .values('total')
+        return Subquery(order_menus)
+
+    @classmethod
+    def update_total_prices(cls, orders):
+        return orders.update(total_price=cls.get_total_price_subquery())
 
     class Meta:
         db_table = 'orders'
+        indexes = [
+            models.Index(fields=['shift_worker', 'created_at'], name='orders_worker_created_idx'),
+        ]
 
 
 class OrderMenu(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='order_menus')
     menu = models.ForeignKey(Menu, on_delete=models.CASCADE, related_name='order_menus')
+    quantity = models.PositiveIntegerField(default=1)
 
     class Meta:
         db_table = 'order_menus'
+
+
+class DailyRevenue(models.Model):
+    """
+    Revenue of a closed shift per day, table and worker, filled by the rollup_revenue command.
+
+    Analytics read these rows instead of the orders of the shifts they
+    cover. Changing an order of a rolled up shift deletes the shift's rows,
+    so it is aggregated from the orders again until the next rollup.
+    """
+    date = models.DateField()
+    work_shift = models.ForeignKey(WorkShift, on_delete=models.CASCADE, related_name='daily_revenues')
+    table = models.ForeignKey(Table, on_delete=models.CASCADE, related_name='daily_revenues')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_revenues')
+    revenue = models.FloatField(default=0)
+    orders = models.IntegerField(default=0)
+    covers = models.IntegerField(default=0)
+
+    @classmethod
+    def invalidate(cls, work_shift_ids):
+        """Deletes the rollups of the shifts, ``work_shift_ids`` can be a ``values()`` queryset."""
+        return cls.objects.filter(work_shift_id__in=work_shift_ids).delete()
+
+    @classmethod
+    def rollup(cls, work_shift_ids):
+        """Aggregates the orders of shifts that have no rollups yet. Returns the number of rows."""
+        groups = Order.objects.filter(shift_worker__work_shift_id__in=work_shift_ids) \
+            .values('table_id', work_shift_id=F('shift_worker__work_shift_id'),
+                    user_id=F('shift_worker__user_id'), date=TruncDate('created_at')) \
+            .annotate(revenue=Coalesce(Sum('total_price'), 0.0), orders=Count('id'),
+                      covers=Coalesce(Sum('number_of_person'), 0)) \
+            .order_by()
+        return len(cls.objects.bulk_create([cls(**group) for group in groups]))
+
+    class Meta:
+        db_table = 'daily_revenues'
+        indexes = [
+            models.Index(fields=['date'], name='daily_revenues_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'work_shift', 'table', 'user'],
+                                    name='daily_revenues_uniq'),
+        ]
+
+
+class ReportJob(models.Model):
+    """
+    Report computed in the background by the run_report_jobs command.
+
+    ``dedup_key`` holds a hash of the kind and the parameters while the job
+    is queued or running, and is cleared when it ends. The unique constraint
+    on it allows one in-flight job per report, NULLs do not collide.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    # done, but its file was removed from the report storage
+    EXPIRED = 'expired'
+    STATUSES = [(QUEUED, QUEUED), (RUNNING, RUNNING), (DONE, DONE), (FAILED, FAILED), (CANCELLED, CANCELLED),
+                (EXPIRED, EXPIRED)]
+    ORDERS = 'orders'
+    REVENUE = 'revenue'
+    KINDS = [(ORDERS, ORDERS), (REVENUE, REVENUE)]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='report_jobs')
+    kind = models.CharField(max_length=50, choices=KINDS)
+    params = models.JSONField(default=dict)
+    dedup_key = models.CharField(max_length=64, unique=True, blank=True, null=True)
+    status = models.CharField(max_length=20, choices=STATUSES, default=QUEUED)
+    progress = models.PositiveSmallIntegerField(default=0)
+    file_name = models.CharField(max_length=254, blank=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    @classmethod
+    def submit(cls, user, kind, params, dedup_key):
+        """Queues the job, or returns the in-flight job of the same report. Returns ``(job, created)``."""
+        for _ in range(2):
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(user=user, kind=kind, params=params, dedup_key=dedup_key), True
+            except IntegrityError:
+                job = cls.objects.filter(dedup_key=dedup_key).first()
+                if job is not None:
+                    return job, False
+        raise IntegrityError('Could not queue the report job')
+
+    @classmethod
+    def claim(cls, worker):
+        """
+        Moves the oldest queued job to running. The conditional update lets one worker win a job.
+
+        The worker is stored with a suffix per attempt, so a run that was
+        requeued as stale can no longer report progress or finish the job.
+        """
+        attempt = '%s/%s' % (worker[:91], get_random_string(8))
+        for pk in cls.objects.filter(status=cls.QUEUED).order_by('id').values_list('id', flat=True)[:10]:
+            now = timezone.now()
+            if cls.objects.filter(pk=pk, status=cls.QUEUED) \
+                    .update(status=cls.RUNNING, worker=attempt, started_at=now, heartbeat_at=now):
+                return cls.objects.get(pk=pk)
+        return None
+
+    @classmethod
+    def requeue_stale(cls, timeout):
+        """Queues running jobs again whose worker stopped reporting progress."""
+        stale = cls.objects.filter(status=cls.RUNNING, heartbeat_at__lt=timezone.now() - timedelta(seconds=timeout))
+        return stale.update(status=cls.QUEUED, worker='', progress=0)
+
+    def set_progress(self, progress):
+        """Returns False once the job is no longer running, e.g. it was cancelled."""
+        self.progress = progress
+        return bool(ReportJob.objects.filter(pk=self.pk, status=self.RUNNING, worker=self.worker)
+                    .update(progress=progress, heartbeat_at=timezone.now()))
+
+    def finish(self, status, file_name='', error=''):
+        return bool(ReportJob.objects.filter(pk=self.pk, status=self.RUNNING, worker=self.worker).update(
+            status=status, dedup_key=None, file_name=file_name, error=error, finished_at=timezone.now(),
+            progress=100 if status == self.DONE else self.progress))
+
+    def cancel(self):
+        return bool(ReportJob.objects.filter(pk=self.pk, status__in=[self.QUEUED, self.RUNNING])
+                    .update(status=self.CANCELLED, dedup_key=None, finished_at=timezone.now()))
+
+    def expire(self):
+        return bool(ReportJob.objects.filter(pk=self.pk, status=self.DONE).update(status=self.EXPIRED, file_name=''))
+
+    class Meta:
+        db_table = 'report_jobs'
+        indexes = [
+            models.Index(fields=['status', 'id'], name='report_jobs_status_idx'),
+        ]
+
+
+class ShiftArchive(models.Model):
+    """
+    Orders of an archived shift, stored as the compressed ``orders`` list of its report.
+
+    The archive_shifts command writes it and deletes the orders, order
+    items and shift workers of the shift from the hot tables.
+    """
+    work_shift = models.OneToOneField(WorkShift, on_delete=models.CASCADE, primary_key=True, related_name='archive')
+    orders = models.BinaryField()
+    order_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'work_shift_archives'
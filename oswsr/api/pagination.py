@@ -0,0 +1,67 @@
+from django.conf import settings
+from rest_framework import status
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .exceptions import CafeValidationAPIException
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pages a queryset by primary key: ``?cursor=<last id>&page_size=<n>``.
+
+    Every page is a single ``id > cursor ORDER BY id LIMIT n`` query, so the
+    cost does not depend on how deep the client has paged.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = getattr(settings, 'API_PAGE_SIZE', 100)
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+
+    def get_int_param(self, request, name, default):
+        value = request.query_params.get(name)
+        if value is None:
+            return default
+        try:
+            value = int(value)
+            if value < 0:
+                raise ValueError
+        except ValueError:
+            raise CafeValidationAPIException(message='Validation error',
+                                             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                             errors={name: ['A positive integer is required.']})
+        return value
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        cursor = self.get_int_param(request, self.cursor_query_param, None)
+        page_size = self.get_int_param(request, self.page_size_query_param, self.page_size)
+        page_size = min(max(page_size, 1), self.max_page_size)
+
+        queryset = queryset.order_by('pk')
+        if cursor is not None:
+            queryset = queryset.filter(pk__gt=cursor)
+        page = list(queryset[:page_size + 1])
+
+        self.has_next = len(page) > page_size
+        page = page[:page_size]
+        self.next_cursor = self.get_pk(page[-1]) if self.has_next else None
+        return page
+
+    def get_pk(self, row):
+        # pages of values() querysets hold dicts
+        return row['pk'] if isinstance(row, dict) else row.pk
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'data': data,
+            'next': self.get_next_link(),
+        })
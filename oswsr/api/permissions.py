@@ -1,15 +1,13 @@
 from rest_framework import permissions, status
-from rest_framework.authentication import get_authorization_header
 
 from .exceptions import CafeAPIException
-from .models import User
+from .reference import reference_data
 
 
 class IsAuthenticated(permissions.BasePermission):
 
     def has_permission(self, request, view):
-        user = User.get_auth_user(request=request)
-        if not user:
+        if not request.user or not request.user.is_authenticated:
             raise CafeAPIException(message='Login failed',
                                    code=status.HTTP_403_FORBIDDEN)
         return True
@@ -19,8 +17,8 @@ class IsAdmin(IsAuthenticated):
 
     def has_permission(self, request, view):
         super().has_permission(request, view)
-        user = User.get_auth_user(request=request)
-        if user.role.code != 'admin':
+        role = reference_data.get('roles', request.user.role_id)
+        if role is None or role.code != 'admin':
             raise CafeAPIException(message='Forbidden for you',
                                    code=status.HTTP_403_FORBIDDEN)
         return True
@@ -0,0 +1,105 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+logger = logging.getLogger(__name__)
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=getattr(settings, 'PHOTO_WORKERS', 2),
+                                          thread_name_prefix='photos')
+        return executor
+
+
+def get_variant_name(name, variant):
+    return '%s_%s.webp' % (os.path.splitext(name)[0], variant)
+
+
+def create_variants(storage, name):
+    """Writes a WebP copy of the photo for every size in ``PHOTO_VARIANTS``."""
+    from PIL import Image
+
+    with Image.open(storage.path(name)) as image:
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        for variant, size in storage.variants.items():
+            resized = image.copy()
+            resized.thumbnail((size, size))
+            resized.save(storage.path(get_variant_name(name, variant)), 'WEBP', quality=80)
+
+
+def process_photo(storage, name):
+    try:
+        create_variants(storage, name)
+    except Exception:
+        logger.exception('Could not create the variants of photo %s', name)
+
+
+@deconstructible
+class PhotoStorage(FileSystemStorage):
+    """
+    Stores uploaded photos under the sha256 of their content.
+
+    The upload is hashed while it is copied to disk chunk by chunk, so a photo
+    that was uploaded before is stored once. The resized variants are created
+    by a background thread pool after the file is written.
+    """
+
+    @property
+    def variants(self):
+        return getattr(settings, 'PHOTO_VARIANTS', {})
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        directory = self.path('')
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+
+            hexdigest = digest.hexdigest()
+            extension = os.path.splitext(name)[1].lower()
+            name = os.path.join(hexdigest[:2], hexdigest + extension)
+            if self.exists(name):
+                return name
+
+            os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+            os.replace(temp_path, self.path(name))
+            if self.file_permissions_mode is not None:
+                os.chmod(self.path(name), self.file_permissions_mode)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        if self.variants:
+            get_executor().submit(process_photo, self, name)
+        return name
+
+    def variant_urls(self, name):
+        urls = {'original': self.url(name)}
+        for variant in self.variants:
+            urls[variant] = self.url(get_variant_name(name, variant))
+        return urls
+
+
+photo_storage = PhotoStorage()
@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from . import caching
+from .models import Role, Status, Table, Menu
+
+logger = logging.getLogger(__name__)
+
+RoleData = namedtuple('RoleData', ['id', 'name', 'code'])
+StatusData = namedtuple('StatusData', ['id', 'name', 'code'])
+TableData = namedtuple('TableData', ['id', 'name', 'capacity'])
+MenuData = namedtuple('MenuData', ['id', 'name', 'price'])
+
+
+class ReferenceData:
+    """
+    Per-process copy of the small lookup tables: roles, statuses, tables and menus.
+
+    Each table is held as a dict of named tuples by primary key. A save or
+    delete drops the local copy at once and changes the ``reference`` version
+    when the transaction commits. Other processes compare the version at most
+    every ``API_REFERENCE_DATA_CHECK_INTERVAL`` seconds and reload when it
+    changed, the version is kept in the api cache, which all workers share.
+
+    A key missing from the copy is looked up once by primary key until the
+    next load, so requests with unknown ids do not reload the tables.
+    """
+
+    tables = {
+        'roles': (Role, RoleData),
+        'statuses': (Status, StatusData),
+        'tables': (Table, TableData),
+        'menus': (Menu, MenuData),
+    }
+
+    def __init__(self):
+        self._data = None
+        self._version = None
+        self._checked_at = 0.0
+        self._missing = set()
+        self._lock = threading.Lock()
+
+    @property
+    def check_interval(self):
+        return getattr(settings, 'API_REFERENCE_DATA_CHECK_INTERVAL', 1)
+
+    def load(self):
+        # the version is read first, so a change during the load triggers another one
+        version = caching.get_versions([caching.REFERENCE])[0]
+        data = {}
+        for name, (model, row_class) in self.tables.items():
+            rows = model.objects.values_list(*row_class._fields)
+            data[name] = {row[0]: row_class(*row) for row in rows}
+        with self._lock:
+            self._data = data
+            self._version = version
+            self._checked_at = time.monotonic()
+            self._missing = set()
+        return data
+
+    def preload(self):
+        """Loads the tables if the database is reachable, otherwise they are loaded on first use."""
+        try:
+            self.load()
+        except DatabaseError as exc:
+            logger.warning('Could not preload the reference data: %s', exc)
+
+    def is_current(self):
+        """Whether the tables are loaded and their version was current at the last check."""
+        if self._data is None:
+            return False
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._checked_at = time.monotonic()
+            if caching.get_versions([caching.REFERENCE])[0] != self._version:
+                return False
+        return True
+
+    def get_data(self):
+        data = self._data
+        return data if self.is_current() else self.load()
+
+    def all(self, name):
+        return self.get_data()[name]
+
+    def get(self, name, pk):
+        """Returns the row, rows created since the last load are read once from the database."""
+        data = self.get_data()
+        row = data[name].get(pk)
+        if row is None and pk is not None and (name, pk) not in self._missing:
+            row = self.get_row(data, name, pk)
+        return row
+
+    def get_row(self, data, name, pk):
+        model, row_class = self.tables[name]
+        row = model.objects.filter(pk=pk).values_list(*row_class._fields).first()
+        with self._lock:
+            if self._data is not data:
+                # reloaded meanwhile
+                return row_class(*row) if row else None
+            if row is None:
+                if len(self._missing) >= getattr(settings, 'API_REFERENCE_DATA_MISSING_SIZE', 1000):
+                    self._missing = set()
+                self._missing.add((name, pk))
+                return None
+            row = row_class(*row)
+            # copied, so readers iterating the current tables are not affected
+            rows = dict(data[name])
+            rows[pk] = row
+            self._data = dict(data, **{name: rows})
+        return row
+
+    def get_by_code(self, name, code):
+        return next((row for row in self.all(name).values() if row.code == code), None)
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+        caching.bump_versions([caching.REFERENCE])
+
+
+reference_data = ReferenceData()
@@ -0,0 +1,33 @@
+from rest_framework import renderers
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    Renders JSON with orjson when it is installed.
+
+    orjson encodes datetimes natively in the same ISO 8601 form as the DRF
+    encoder, anything else it does not know (Decimal, lazy strings, ...) goes
+    through the DRF encoder. Indented output, ASCII-only output and data
+    orjson rejects, such as non-string keys, are rendered by the stdlib
+    ``json`` path of the parent class.
+    """
+
+    options = orjson.OPT_UTC_Z if orjson is not None else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # escaped like the parent class, so the output is a strict javascript subset
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
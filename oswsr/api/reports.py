@@ -0,0 +1,43 @@
+from rest_framework import serializers
+
+from .archive import get_archived_orders
+from .models import Order
+from .serializers import OrderValuesSerializer
+
+
+class ShiftOrdersReport:
+    """
+    Builds the ``/work-shift/{id}/order`` payload with a single query.
+
+    The output matches ``ShiftOrdersSerializer``: orders are grouped by
+    shift worker, and prices come from the order and shift rollups. The
+    orders of an archived shift come from its ``ShiftArchive``.
+    """
+
+    datetime_field = serializers.DateTimeField()
+    order_serializer_class = OrderValuesSerializer
+
+    def __init__(self, work_shift):
+        self.work_shift = work_shift
+        self.order_serializer = self.order_serializer_class()
+
+    def get_orders(self):
+        orders = Order.objects.filter(shift_worker__work_shift=self.work_shift).order_by('shift_worker_id', 'id')
+        return self.order_serializer.values(orders)
+
+    @property
+    def data(self):
+        if self.work_shift.archived_at is not None:
+            orders = get_archived_orders(self.work_shift)
+        else:
+            orders = self.order_serializer.serialize(self.get_orders())
+
+        work_shift = self.work_shift
+        return {
+            'id': work_shift.id,
+            'start': self.datetime_field.to_representation(work_shift.start),
+            'end': self.datetime_field.to_representation(work_shift.end),
+            'active': int(work_shift.active),
+            'orders': orders,
+            'amount_for_all': work_shift.get_price(),
+        }
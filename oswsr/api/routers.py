@@ -0,0 +1,146 @@
+"""
+Read replica routing with read-your-writes stickiness.
+
+Writes always go to the primary ``default`` database. Reads go to one of
+the ``API_DATABASE_REPLICAS`` aliases only while a request is in flight,
+uses a safe method and has not written yet; management commands, report
+jobs and signals outside a request read from the primary.
+
+After a request writes, its client (the bearer token, or the address of
+an anonymous client) reads from the primary for ``API_DATABASE_STICKY_SECONDS``
+so it sees its own writes before they reach the replicas. The pin is kept
+in the api cache, so it holds on whichever worker the next request lands.
+"""
+import asyncio
+import contextvars
+import hashlib
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from . import caching
+from .utilities import get_bearer_token
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = contextvars.ContextVar('api_database_state', default=None)
+
+
+class RoutingState:
+
+    def __init__(self, use_replicas):
+        self.use_replicas = use_replicas
+        self.wrote = False
+        self.replica = None
+
+
+def get_replicas():
+    return [alias for alias in getattr(settings, 'API_DATABASE_REPLICAS', []) if alias in settings.DATABASES]
+
+
+def get_sticky_seconds():
+    return getattr(settings, 'API_DATABASE_STICKY_SECONDS', 5)
+
+
+def use_primary():
+    """Sends the remaining reads of the current request to the primary, e.g. before a write on GET."""
+    state = _state.get()
+    if state is not None:
+        state.use_replicas = False
+
+
+def use_primary_if_changed(keys):
+    """Reads from the primary while any of the cache version ``keys`` changed within the sticky window."""
+    state = _state.get()
+    if state is not None and state.use_replicas \
+            and caching.get_cache().get_many(['changed:%s' % key for key in keys]):
+        state.use_replicas = False
+
+
+class ReplicaRouter:
+    # api tokens are read from the primary, so a new login or a revoked
+    # token takes effect at once
+    primary_models = {'api.apitoken'}
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replicas or state.wrote \
+                or model._meta.label_lower in self.primary_models:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            # one replica per request, so its reads see a single point in time
+            state.replica = random.choice(get_replicas())
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Tracks the routing state of a request for ``ReplicaRouter``.
+
+    Without configured replicas the middleware does nothing. Under ASGI it
+    stays async, the views running through ``sync_to_async`` share the state
+    of their request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # tells Django the middleware is called as a coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def get_client_key(self, request):
+        client = get_bearer_token(request) or request.META.get('REMOTE_ADDR', '')
+        return 'primary:%s' % hashlib.sha1(client.encode()).hexdigest()
+
+    def get_state(self, request, key):
+        return RoutingState(use_replicas=request.method in SAFE_METHODS and not caching.get_cache().get(key))
+
+    def pin_to_primary(self, state, key):
+        if state.wrote:
+            caching.get_cache().set(key, True, timeout=get_sticky_seconds())
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not get_replicas():
+            return self.get_response(request)
+
+        key = self.get_client_key(request)
+        state = self.get_state(request, key)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        self.pin_to_primary(state, key)
+        return response
+
+    async def __acall__(self, request):
+        if not get_replicas():
+            return await self.get_response(request)
+
+        key = self.get_client_key(request)
+        state = self.get_state(request, key)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        self.pin_to_primary(state, key)
+        return response
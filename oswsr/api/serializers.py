@@ -2,8 +2,10 @@ from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.fields import CharField
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
-from .models import User, Role, WorkShift, ShiftWorker, Order
+from .models import User, Role, WorkShift, ShiftWorker, Menu, Order, ReportJob
+from .reference import reference_data
 
 
 class LoginSerializer(serializers.ModelSerializer):
@@ -27,13 +29,92 @@ class UserListSerializer(serializers.ListSerializer):
         return serializers.ReturnDict(ret, serializer=self)
 
 
+class PhotoField(serializers.ReadOnlyField):
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return value.storage.variant_urls(value.name)
+
+
 class UserSerializer(serializers.ModelSerializer):
     group = serializers.ReadOnlyField(source='role.name')
+    photo = PhotoField(source='photo_file')
+
+    # photo is only rendered when it is asked for
+    default_fields = ['id', 'name', 'login', 'status', 'group']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None:
+            fields = self.default_fields
+        for name in set(self.fields) - set(fields):
+            self.fields.pop(name)
+
+    @classmethod
+    def get_model_fields(cls, fields):
+        """Maps serializer field names to the model fields they are read from."""
+        declared = cls(fields=cls.Meta.fields).fields
+        return [declared[name].source.replace('.', '__') for name in fields]
 
     class Meta:
         model = User
         list_serializer_class = UserListSerializer
-        fields = ['id', 'name', 'login', 'status', 'group']
+        fields = ['id', 'name', 'login', 'status', 'group', 'photo']
+
+
+class ValuesSerializer:
+    """
+    Read-only serializer for the rows of a ``values()`` queryset.
+
+    ``fields`` maps every output name to the lookup it is read from, and a
+    ``to_<name>`` method converts the value when the raw column is not the
+    output. Rendering a row is a single dict comprehension, without the DRF
+    field objects a ``ModelSerializer`` runs per value.
+    """
+    fields = {}
+
+    def __init__(self, fields=None):
+        if fields is None:
+            fields = list(self.fields)
+        self.columns = [(name, self.fields[name], getattr(self, 'to_%s' % name, None)) for name in fields]
+
+    def values(self, queryset, *extra):
+        """Reads the columns of the fields, plus the ``extra`` lookups the caller needs."""
+        # the primary key is always read, keyset pagination pages by it
+        lookups = dict.fromkeys([lookup for _, lookup, _ in self.columns] + list(extra))
+        return queryset.values('pk', *lookups)
+
+    def to_representation(self, row):
+        return {name: row[lookup] if convert is None else convert(row[lookup])
+                for name, lookup, convert in self.columns}
+
+    def serialize(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+
+class UserValuesSerializer(ValuesSerializer):
+    """Renders the same dicts as ``UserSerializer``."""
+    fields = {
+        'id': 'id',
+        'name': 'name',
+        'login': 'login',
+        'status': 'status',
+        'group': 'role_id',
+        'photo': 'photo_file',
+    }
+    default_fields = UserSerializer.default_fields
+
+    def __init__(self, fields=None):
+        super().__init__(self.default_fields if fields is None else fields)
+
+    def to_group(self, role_id):
+        return reference_data.get('roles', role_id).name
+
+    def to_photo(self, name):
+        if not name:
+            return None
+        return User._meta.get_field('photo_file').storage.variant_urls(name)
 
 
 class UserCreateSerializer(serializers.ModelSerializer):
@@ -52,6 +133,39 @@ class UserCreateSerializer(serializers.ModelSerializer):
         exclude = ['role']
 
 
+class UserImportListSerializer(serializers.ListSerializer):
+
+    def validate(self, attrs):
+        logins = [row['login'] for row in attrs]
+        # the unique index of MySQL compares logins case-insensitively
+        taken = {login.lower() for login in User.objects.filter(login__in=logins).values_list('login', flat=True)}
+        seen = set()
+        errors = {}
+        for index, login in enumerate(login.lower() for login in logins):
+            if login in taken or login in seen:
+                errors[index] = {'login': ['user with this login already exists.']}
+            seen.add(login)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
+
+
+class UserImportSerializer(serializers.ModelSerializer):
+    """Validates a batch of users against the role map passed in ``context['roles']``."""
+    role_id = serializers.IntegerField(write_only=True)
+
+    def validate_role_id(self, value):
+        if value not in self.context['roles']:
+            raise serializers.ValidationError('Invalid pk "%s" - object does not exist.' % value)
+        return value
+
+    class Meta:
+        model = User
+        list_serializer_class = UserImportListSerializer
+        fields = ['name', 'surname', 'patronymic', 'login', 'password', 'status', 'role_id']
+        extra_kwargs = {'login': {'validators': []}}
+
+
 class WorkShiftSerializer(serializers.ModelSerializer):
     start = serializers.DateTimeField(format="%Y-%m-%d %H:%M", input_formats=['%Y-%m-%d %H:%M'])
     end = serializers.DateTimeField(format="%Y-%m-%d %H:%M", input_formats=['%Y-%m-%d %H:%M'])
@@ -68,7 +182,7 @@ class WorkShiftSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = WorkShift
-        exclude = ['active']
+        exclude = ['active', 'archived_at']
 
 
 class WorkSiftDetailSerializer(serializers.ModelSerializer):
@@ -82,7 +196,7 @@ class WorkSiftDetailSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = WorkShift
-        fields = '__all__'
+        exclude = ['archived_at']
 
 
 class ShiftWorkerSerializer(serializers.ModelSerializer):
@@ -96,6 +210,64 @@ class ShiftWorkerSerializer(serializers.ModelSerializer):
         exclude = ['user', 'work_shift']
 
 
+class ShiftWorkerItemSerializer(serializers.Serializer):
+    work_shift_id = serializers.IntegerField()
+    user_id = serializers.IntegerField()
+
+
+class ShiftWorkerBulkSerializer(serializers.Serializer):
+    workers = ShiftWorkerItemSerializer(many=True, allow_empty=False)
+
+
+class ShiftWorkerIdsSerializer(serializers.Serializer):
+    user_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+
+class OrderItemListSerializer(serializers.ListSerializer):
+
+    def validate(self, attrs):
+        menu_ids = {item['menu_id'] for item in attrs}
+        existing = set(Menu.objects.filter(id__in=menu_ids).values_list('id', flat=True))
+        errors = {index: {'menu_id': ['Invalid pk "%s" - object does not exist.' % item['menu_id']]}
+                  for index, item in enumerate(attrs) if item['menu_id'] not in existing}
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        # one line per menu, repeated menus add up their quantities
+        quantities = {}
+        for item in attrs:
+            quantities[item['menu_id']] = quantities.get(item['menu_id'], 0) + item['quantity']
+        return [{'menu_id': menu_id, 'quantity': quantity} for menu_id, quantity in quantities.items()]
+
+
+class OrderItemSerializer(serializers.Serializer):
+    menu_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=1000, default=1)
+
+    class Meta:
+        list_serializer_class = OrderItemListSerializer
+
+
+class OrderItemsSerializer(serializers.Serializer):
+    """Basket of menu items, the menu ids of the whole basket are checked with one query."""
+    items = OrderItemSerializer(many=True, allow_empty=False)
+
+
+class OrderCreateSerializer(serializers.Serializer):
+    table_id = serializers.IntegerField()
+    number_of_person = serializers.IntegerField(min_value=1)
+    items = OrderItemSerializer(many=True, required=False)
+
+    def validate_table_id(self, value):
+        if reference_data.get('tables', value) is None:
+            raise serializers.ValidationError('Invalid pk "%s" - object does not exist.' % value)
+        return value
+
+
+class OrderPositionIdsSerializer(serializers.Serializer):
+    position_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+
 class OrderListSerializer(serializers.HyperlinkedModelSerializer):
     table = serializers.ReadOnlyField(source='table.name')
     shift_workers = serializers.ReadOnlyField(source='shift_worker.user.name')
@@ -111,6 +283,47 @@ class OrderListSerializer(serializers.HyperlinkedModelSerializer):
         fields = ['id', 'table', 'shift_workers', 'create_at', 'status', 'price']
 
 
+class OrderValuesSerializer(ValuesSerializer):
+    """
+    Renders the same dicts as ``OrderListSerializer``. Table and status names
+    come from the reference data and prices from the order rollup.
+    """
+    fields = {
+        'id': 'id',
+        'table': 'table_id',
+        'shift_workers': 'shift_worker__user__name',
+        'create_at': 'created_at',
+        'status': 'status_order_id',
+        'price': 'total_price',
+    }
+
+    def to_table(self, table_id):
+        return reference_data.get('tables', table_id).name
+
+    def to_status(self, status_id):
+        return reference_data.get('statuses', status_id).name
+
+    def to_price(self, total_price):
+        return 0 if total_price is None else total_price
+
+
+class OrderPositionValuesSerializer(ValuesSerializer):
+    """Renders the lines of an order, menu names and prices come from the reference data."""
+    fields = {
+        'id': 'id',
+        'menu_id': 'menu_id',
+        'name': 'menu_id',
+        'price': 'menu_id',
+        'quantity': 'quantity',
+    }
+
+    def to_name(self, menu_id):
+        return reference_data.get('menus', menu_id).name
+
+    def to_price(self, menu_id):
+        return reference_data.get('menus', menu_id).price
+
+
 class ShiftOrdersSerializer(serializers.HyperlinkedModelSerializer):
     active = serializers.IntegerField()
     orders = serializers.SerializerMethodField()
@@ -122,11 +335,49 @@ class ShiftOrdersSerializer(serializers.HyperlinkedModelSerializer):
         return serializer.data
 
     def get_amount_for_all(self, obj):
-        price = 0
-        for order in obj.get_orders():
-            price += order.get_price()
-        return price
+        return obj.get_price()
 
     class Meta:
         model = WorkShift
         fields = ['id', 'start', 'end', 'active', 'orders', 'amount_for_all']
+
+
+class OrderExportSerializer(serializers.Serializer):
+    type = serializers.ChoiceField(choices=['ndjson', 'csv'], default='ndjson')
+    start = serializers.DateTimeField(required=False, input_formats=['%Y-%m-%d %H:%M', '%Y-%m-%d'])
+    end = serializers.DateTimeField(required=False, input_formats=['%Y-%m-%d %H:%M', '%Y-%m-%d'])
+
+    def validate(self, data):
+        if 'start' in data and 'end' in data and data['start'] >= data['end']:
+            raise serializers.ValidationError('The end date cannot be earlier than the start date')
+        return data
+
+
+class RevenueAnalyticsSerializer(serializers.Serializer):
+    group_by = serializers.ChoiceField(choices=['hour', 'day', 'table', 'worker', 'menu'], default='day')
+    start = serializers.DateTimeField(required=False, input_formats=['%Y-%m-%d %H:%M', '%Y-%m-%d'])
+    end = serializers.DateTimeField(required=False, input_formats=['%Y-%m-%d %H:%M', '%Y-%m-%d'])
+
+    def validate(self, data):
+        if 'start' in data and 'end' in data and data['start'] >= data['end']:
+            raise serializers.ValidationError('The end date cannot be earlier than the start date')
+        return data
+
+
+class ReportJobCreateSerializer(serializers.Serializer):
+    kind = serializers.ChoiceField(choices=ReportJob.KINDS)
+    params = serializers.DictField(default=dict)
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    download = serializers.SerializerMethodField()
+
+    def get_download(self, obj):
+        if obj.status != ReportJob.DONE:
+            return None
+        return reverse('reportjob-download', args=[obj.pk], request=self.context.get('request'))
+
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'kind', 'params', 'status', 'progress', 'error', 'created_at', 'started_at', 'finished_at',
+                  'download']
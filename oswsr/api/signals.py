@@ -0,0 +1,141 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
+from django.dispatch import receiver
+
+from . import caching, events, metrics
+from .authentication import token_cache
+from .models import Role, User, WorkShift, ShiftWorker, Status, Table, Menu, Order, OrderMenu, DailyRevenue
+from .reference import reference_data
+
+
+@receiver(connection_created)
+def count_connection_queries(sender, connection, **kwargs):
+    metrics.install_query_counter(connection)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_token(sender, instance, **kwargs):
+    token_cache.invalidate_user(instance.pk)
+    # the token caches of the other workers
+    caching.bump_versions([caching.user_key(instance.pk)])
+
+
+@receiver([post_save, post_delete], sender=OrderMenu)
+def update_order_total_price(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    with transaction.atomic():
+        Order.update_total_prices(Order.objects.filter(id=instance.order_id))
+        WorkShift.update_total_prices(WorkShift.objects.filter(shift_workers__orders__id=instance.order_id))
+
+
+@receiver(post_delete, sender=Order)
+def update_shift_total_price(sender, instance, **kwargs):
+    WorkShift.update_total_prices(WorkShift.objects.filter(shift_workers__id=instance.shift_worker_id))
+
+
+@receiver(pre_save, sender=Menu)
+def check_menu_price(sender, instance, raw=False, **kwargs):
+    instance._price_changed = not raw and instance.pk is not None and \
+        Menu.objects.filter(pk=instance.pk).exclude(price=instance.price).exists()
+
+
+@receiver(post_save, sender=Menu)
+def update_menu_total_prices(sender, instance, **kwargs):
+    if not getattr(instance, '_price_changed', False):
+        return
+    with transaction.atomic():
+        Order.update_total_prices(Order.objects.filter(order_menus__menu=instance))
+        WorkShift.update_total_prices(WorkShift.objects.filter(shift_workers__orders__order_menus__menu=instance))
+        DailyRevenue.invalidate(Order.objects.filter(order_menus__menu=instance).values('shift_worker__work_shift_id'))
+
+
+@receiver([post_save, post_delete], sender=Order)
+def invalidate_order_daily_revenue(sender, instance, raw=False, **kwargs):
+    if not raw:
+        DailyRevenue.invalidate(ShiftWorker.objects.filter(id=instance.shift_worker_id).values('work_shift_id'))
+
+
+@receiver([post_save, post_delete], sender=OrderMenu)
+def invalidate_order_menu_daily_revenue(sender, instance, raw=False, **kwargs):
+    if not raw:
+        DailyRevenue.invalidate(Order.objects.filter(id=instance.order_id).values('shift_worker__work_shift_id'))
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Role)
+def bump_users_version(sender, **kwargs):
+    # user and role names are also part of every shift report
+    caching.bump_versions([caching.USERS, caching.WORK_SHIFTS])
+
+
+@receiver([post_save, post_delete], sender=Menu)
+@receiver([post_save, post_delete], sender=Status)
+@receiver([post_save, post_delete], sender=Table)
+def bump_work_shifts_version(sender, **kwargs):
+    caching.bump_versions([caching.WORK_SHIFTS])
+
+
+@receiver([post_save, post_delete], sender=Role)
+@receiver([post_save, post_delete], sender=Status)
+@receiver([post_save, post_delete], sender=Table)
+@receiver([post_save, post_delete], sender=Menu)
+def invalidate_reference_data(sender, **kwargs):
+    reference_data.invalidate()
+
+
+@receiver(post_migrate)
+def reload_reference_data(sender, **kwargs):
+    # the tables may have been created or filled by the migrations
+    reference_data.invalidate()
+
+
+@receiver([post_save, post_delete], sender=WorkShift)
+def bump_work_shift_version(sender, instance, **kwargs):
+    caching.bump_versions([caching.work_shift_key(instance.pk)])
+
+
+@receiver([post_save, post_delete], sender=ShiftWorker)
+def bump_shift_worker_version(sender, instance, **kwargs):
+    caching.bump_versions([caching.work_shift_key(instance.work_shift_id)])
+
+
+@receiver([post_save, post_delete], sender=Order)
+def bump_order_version(sender, instance, **kwargs):
+    work_shift_ids = ShiftWorker.objects.filter(id=instance.shift_worker_id).values_list('work_shift_id', flat=True)
+    caching.bump_versions(caching.work_shift_key(work_shift_id) for work_shift_id in work_shift_ids)
+
+
+@receiver([post_save, post_delete], sender=OrderMenu)
+def bump_order_menu_version(sender, instance, **kwargs):
+    work_shift_ids = WorkShift.objects.filter(shift_workers__orders__id=instance.order_id).values_list('id', flat=True)
+    caching.bump_versions(caching.work_shift_key(work_shift_id) for work_shift_id in work_shift_ids)
+
+
+@receiver(post_save, sender=Order)
+def publish_order_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        events.publish_order(events.ORDER_CREATED if created else events.ORDER_UPDATED, instance.pk)
+
+
+@receiver(post_delete, sender=Order)
+def publish_order_deleted(sender, instance, **kwargs):
+    if not events.hub.has_subscribers():
+        return
+    work_shift_ids = ShiftWorker.objects.filter(id=instance.shift_worker_id).values_list('work_shift_id', flat=True)
+    for work_shift_id in work_shift_ids:
+        events.publish_event(work_shift_id, events.ORDER_DELETED, {'id': instance.pk})
+
+
+@receiver([post_save, post_delete], sender=OrderMenu)
+def publish_order_items_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        events.publish_order(events.ORDER_UPDATED, instance.order_id)
+
+
+@receiver(post_save, sender=WorkShift)
+def publish_work_shift_closed(sender, instance, raw=False, **kwargs):
+    # feed clients of the shift reconnect to the next active one
+    if not raw and not instance.active:
+        events.publish_event(instance.pk, events.WORK_SHIFT_CLOSED, {'id': instance.pk})
@@ -1,3 +1,1295 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from functools import partial
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import connection, connections, IntegrityError
+from django.db.utils import load_backend
+from django.test import AsyncClient, TestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework import renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from oswsr import asgi
+
+from . import caching, events, photos
+from .archive import archive_shifts
+from .authentication import token_cache, BearerTokenAuthentication
+from .backends.pool import ConnectionPool, PoolTimeout, pools, get_pool_stats
+from .checks import check_api_cache
+from .events import hub
+from .exports import OrderExport
+from .jobs import report_storage, run_job
+from .metrics import registry
+from .models import ApiToken, Role, User, WorkShift, ShiftWorker, Status, Table, Menu, Order, OrderMenu, \
+    DailyRevenue, ReportJob
+from .parsers import JSONParser
+from .permissions import IsAdmin
+from .reference import ReferenceData, reference_data
+from .renderers import JSONRenderer
+from .reports import ShiftOrdersReport
+from .routers import ReplicaRoutingMiddleware
+from .serializers import ShiftOrdersSerializer, OrderListSerializer, OrderValuesSerializer, UserSerializer, \
+    UserValuesSerializer
+from .throttling import bucket_store, concurrency_limiter, TokenBucketStore
+from .views import UserList
+
+
+class CafeTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_role = Role.objects.create(name='Administrator', code='admin')
+        cls.waiter_role = Role.objects.create(name='Waiter', code='waiter')
+        cls.admin = User.objects.create(name='admin', login='admin', password='admin', role=cls.admin_role)
+        cls.waiter = User.objects.create(name='waiter', login='waiter', password='waiter', role=cls.waiter_role)
+        expires_at = timezone.now() + timedelta(days=1)
+        for user, key in [(cls.admin, 'admin-token'), (cls.waiter, 'waiter-token')]:
+            ApiToken.objects.create(user=user, key_hash=ApiToken.hash_key(key), expires_at=expires_at)
+
+    def setUp(self):
+        token_cache.clear()
+        bucket_store.clear()
+        caching.get_cache().clear()
+        # rows of the previous test were rolled back without a signal
+        reference_data.load()
+        self.client = APIClient()
+
+    def authorize(self, token='admin-token'):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+
+
+class AuthenticationTest(CafeTestCase):
+
+    def test_missing_token(self):
+        response = self.client.get('/api-cafe/user')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['error']['message'], 'Login failed')
+
+    def test_not_admin(self):
+        self.authorize('waiter-token')
+        response = self.client.get('/api-cafe/user')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['error']['message'], 'Forbidden for you')
+
+    def test_warm_cache_skips_auth_queries(self):
+        def check_admin():
+            request = Request(APIRequestFactory().get('/', HTTP_AUTHORIZATION='Bearer admin-token'),
+                              authenticators=[BearerTokenAuthentication()])
+            return IsAdmin().has_permission(request, None)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(check_admin())
+        with self.assertNumQueries(0):
+            self.assertTrue(check_admin())
+
+    def test_login_and_logout(self):
+        with self.assertNumQueries(2):
+            response = self.client.post('/api-cafe/login', {'login': 'admin', 'password': 'admin'}, format='json')
+        token = response.json()['data']['user_token']
+
+        self.authorize(token)
+        self.assertEqual(self.client.get('/api-cafe/user').status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api-cafe/logout').status_code, 200)
+        self.assertEqual(self.client.get('/api-cafe/user').status_code, 403)
+
+        # the other devices stay logged in
+        self.authorize()
+        self.assertEqual(self.client.get('/api-cafe/user').status_code, 200)
+
+    def test_changed_in_other_worker(self):
+        def authenticate(token):
+            request = Request(APIRequestFactory().get('/', HTTP_AUTHORIZATION='Bearer ' + token))
+            user_auth = BearerTokenAuthentication().authenticate(request)
+            return user_auth and user_auth[0]
+
+        self.assertEqual(authenticate('admin-token'), self.admin)
+        # revoked by another worker, the local token cache still holds the token
+        with self.captureOnCommitCallbacks(execute=True):
+            ApiToken.revoke('admin-token')
+        self.assertIn('admin-token', token_cache._entries)
+        self.assertIsNone(authenticate('admin-token'))
+
+        self.assertEqual(authenticate('waiter-token').role_id, self.waiter_role.id)
+        with mock.patch.object(token_cache, 'invalidate_user'), self.captureOnCommitCallbacks(execute=True):
+            self.waiter.role = self.admin_role
+            self.waiter.save()
+        self.assertEqual(authenticate('waiter-token').role_id, self.admin_role.id)
+
+    def test_expired_token(self):
+        ApiToken.objects.filter(key_hash=ApiToken.hash_key('admin-token')).update(expires_at=timezone.now())
+        self.authorize()
+        self.assertEqual(self.client.get('/api-cafe/user').status_code, 403)
+
+        call_command('clear_tokens', batch_size=1, stdout=StringIO())
+        self.assertEqual(list(ApiToken.objects.values_list('user', flat=True)), [self.waiter.id])
+
+
+class ShiftOrdersTestCase(CafeTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        cls.work_shift = WorkShift.objects.create(start=now, end=now + timedelta(hours=8), active=True)
+        cls.table = Table.objects.create(name='Table 1', capacity=4)
+        cls.status = Status.objects.create(name='Accepted', code='taken')
+        cls.menus = [Menu.objects.create(name='Menu %d' % i, description='', price=price)
+                     for i, price in enumerate([99.9, 150.0, 0.1])]
+        for user in [cls.waiter, cls.admin]:
+            shift_worker = ShiftWorker.objects.create(user=user, work_shift=cls.work_shift)
+            for i in range(5):
+                order = Order.objects.create(number_of_person=2, table=cls.table, shift_worker=shift_worker,
+                                             status_order=cls.status, created_at=now)
+                for menu in cls.menus[:i]:
+                    OrderMenu.objects.create(order=order, menu=menu)
+        cls.work_shift.refresh_from_db()
+
+
+class ShiftOrdersReportTest(ShiftOrdersTestCase):
+
+    def test_matches_serializer(self):
+        expected = JSONRenderer().render(ShiftOrdersSerializer(self.work_shift).data)
+        self.assertEqual(JSONRenderer().render(ShiftOrdersReport(self.work_shift).data), expected)
+
+    def test_prices_match_order_items(self):
+        # both the report and the serializer read the rollups, the items are summed independently
+        prices = {}
+        for order_id, price, quantity in OrderMenu.objects.values_list('order_id', 'menu__price', 'quantity'):
+            prices[order_id] = prices.get(order_id, 0) + price * quantity
+        data = ShiftOrdersReport(self.work_shift).data
+        self.assertEqual(len(data['orders']), 10)
+        for order in data['orders']:
+            self.assertAlmostEqual(order['price'], prices.get(order['id'], 0))
+        self.assertAlmostEqual(data['amount_for_all'], sum(prices.values()))
+        self.assertAlmostEqual(data['amount_for_all'], 2 * (4 * 99.9 + 3 * 150.0 + 2 * 0.1))
+
+    def test_query_count(self):
+        with self.assertNumQueries(1):
+            ShiftOrdersReport(self.work_shift).data
+
+    def test_endpoint(self):
+        self.authorize()
+        response = self.client.get('/api-cafe/work-shift/%d/order' % self.work_shift.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']['orders']), 10)
+
+
+class ShiftArchiveTest(ShiftOrdersTestCase):
+
+    def close_shift(self, days_ago):
+        end = timezone.now() - timedelta(days=days_ago)
+        WorkShift.objects.filter(pk=self.work_shift.pk).update(active=False, start=end - timedelta(hours=8), end=end)
+        self.work_shift.refresh_from_db()
+
+    def get_report(self):
+        response = self.client.get('/api-cafe/work-shift/%d/order' % self.work_shift.id)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_archive(self):
+        self.authorize()
+        self.close_shift(days_ago=100)
+        expected = self.get_report()
+
+        out = StringIO()
+        call_command('archive_shifts', batch_size=1, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Archived 1 shifts with 10 orders')
+        self.assertEqual((Order.objects.count(), OrderMenu.objects.count(), ShiftWorker.objects.count()), (0, 0, 0))
+        self.work_shift.refresh_from_db()
+        self.assertIsNotNone(self.work_shift.archived_at)
+        self.assertEqual(self.work_shift.archive.order_count, 10)
+        self.assertEqual(DailyRevenue.objects.filter(work_shift=self.work_shift).count(), 2)
+
+        # served from the archive, the cached report was invalidated
+        with self.assertNumQueries(1):
+            ShiftOrdersReport(self.work_shift).data
+        self.assertEqual(self.get_report(), expected)
+
+        call_command('rollup_revenue', rebuild=True, stdout=StringIO())
+        self.assertEqual(DailyRevenue.objects.filter(work_shift=self.work_shift).count(), 2)
+
+    def test_retention(self):
+        self.close_shift(days_ago=10)
+        call_command('archive_shifts', retention_days=30, stdout=StringIO())
+        self.assertEqual(Order.objects.count(), 10)
+        call_command('archive_shifts', retention_days=5, stdout=StringIO())
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_archived_shift_reads(self):
+        self.authorize()
+        self.close_shift(days_ago=100)
+        path = '/api-cafe/work-shift/%d' % self.work_shift.id
+        self.assertEqual(self.client.get(path + '/order/export')['X-Export-Complete'], 'true')
+        archive_shifts([self.work_shift.id])
+
+        response = self.client.get(path + '/open')
+        self.assertEqual((response.status_code, response.json()['error']['message']),
+                         (403, 'Forbidden. The shift is archived!'))
+        self.assertFalse(WorkShift.objects.get(pk=self.work_shift.pk).active)
+
+        self.assertEqual(self.client.get(path + '/order/export')['X-Export-Complete'], 'false')
+        response = self.client.get('/api-cafe/work-shift/order/export', {'start': timezone.localdate().isoformat()})
+        self.assertEqual(response['X-Export-Complete'], 'true')
+
+        def is_complete(**params):
+            return self.client.get('/api-cafe/analytics/revenue', params).json()['data']['complete']
+
+        self.assertTrue(is_complete(group_by='day'))
+        self.assertFalse(is_complete(group_by='menu'))
+        self.assertTrue(is_complete(group_by='menu', start=timezone.localdate().isoformat()))
+
+    def test_rebuild_rollups_keeps_archived_totals(self):
+        self.close_shift(days_ago=100)
+        archive_shifts([self.work_shift.id])
+        total_price = WorkShift.objects.get(pk=self.work_shift.pk).total_price
+        self.assertIsNotNone(total_price)
+
+        out = StringIO()
+        call_command('rebuild_rollups', stdout=out)
+        self.assertIn('Rollups are consistent', out.getvalue())
+        self.assertEqual(WorkShift.objects.get(pk=self.work_shift.pk).total_price, total_price)
+
+    def test_active_shift_is_kept(self):
+        WorkShift.objects.filter(pk=self.work_shift.pk).update(end=timezone.now() - timedelta(days=100))
+        self.assertEqual(archive_shifts([self.work_shift.id]), ([], 0))
+        self.assertEqual(Order.objects.count(), 10)
+
+
+@override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={'token': '2/min',
+                                                                                       'login': '1/min'}))
+class ThrottlingTest(ShiftOrdersTestCase):
+
+    def test_token_bucket(self):
+        store = TokenBucketStore(max_size=2)
+        with mock.patch('api.throttling.time.monotonic', return_value=100.0):
+            self.assertEqual([store.consume('a', 0.5, 2) for _ in range(3)], [(True, 0), (True, 0), (False, 2.0)])
+        with mock.patch('api.throttling.time.monotonic', return_value=101.0):
+            self.assertEqual(store.consume('a', 0.5, 2), (False, 1.0))
+        with mock.patch('api.throttling.time.monotonic', return_value=102.0):
+            self.assertEqual(store.consume('a', 0.5, 2), (True, 0))
+            # the least recently used bucket is dropped
+            store.consume('b', 0.5, 2)
+            store.consume('c', 0.5, 2)
+            self.assertEqual(store.consume('a', 0.5, 2), (True, 0))
+
+    def test_token_throttle(self):
+        self.authorize()
+        path = '/api-cafe/work-shift/%d/order' % self.work_shift.id
+        self.assertEqual([self.client.get(path).status_code for _ in range(2)], [200, 200])
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json(), {'error': {'code': 429, 'message': 'Too many requests'}})
+        self.assertEqual(response['Retry-After'], '30')
+
+        response = async_to_sync(AsyncClient().get)('/api-cafe/async' + path[9:], authorization='Bearer admin-token')
+        self.assertEqual((response.status_code, response.get('Retry-After')), (429, '30'))
+        # other clients keep their own budget
+        ApiToken.objects.create(user=self.admin, key_hash=ApiToken.hash_key('other-token'),
+                                expires_at=timezone.now() + timedelta(days=1))
+        self.assertEqual(APIClient(HTTP_AUTHORIZATION='Bearer other-token').get(path).status_code, 200)
+
+    def test_login_throttle(self):
+        self.assertEqual(self.client.post('/api-cafe/login', {'login': 'admin', 'password': 'admin'}).status_code, 200)
+        response = self.client.post('/api-cafe/login', {'login': 'admin', 'password': 'admin'})
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(API_CONCURRENCY_LIMIT=1)
+    def test_concurrency_limit(self):
+        self.authorize()
+        path = '/api-cafe/work-shift/%d/order' % self.work_shift.id
+        route = resolve(path).route
+        # another request of the route is in flight
+        self.assertTrue(concurrency_limiter.acquire(route, 1))
+        try:
+            response = self.client.get(path)
+        finally:
+            concurrency_limiter.release(route)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['error']['code'], 503)
+
+        self.assertEqual(self.client.get(path).status_code, 200)
+        self.assertEqual(concurrency_limiter.in_flight(route), 0)
+        with self.settings(API_CONCURRENCY_LIMITS={route: 0}):
+            self.assertEqual(self.client.get(path).status_code, 503)
+
+    @override_settings(API_CONCURRENCY_LIMIT=1)
+    def test_async_concurrency_limit(self):
+        path = '/api-cafe/async/user'
+        route = resolve(path).route
+        get = async_to_sync(AsyncClient().get)
+        in_flight = []
+        user_list = UserList.list
+
+        def list_users(view, request):
+            in_flight.append(concurrency_limiter.in_flight(route))
+            return user_list(view, request)
+
+        with mock.patch.object(UserList, 'list', list_users):
+            self.assertEqual(get(path, authorization='Bearer admin-token').status_code, 200)
+        self.assertEqual((in_flight, concurrency_limiter.in_flight(route)), ([1], 0))
+
+        self.assertTrue(concurrency_limiter.acquire(route, 1))
+        try:
+            self.assertEqual(get(path, authorization='Bearer admin-token').status_code, 503)
+        finally:
+            concurrency_limiter.release(route)
+
+
+class ValuesSerializerTest(ShiftOrdersTestCase):
+
+    def test_orders_match_serializer(self):
+        orders = Order.objects.order_by('id')
+        expected = JSONRenderer().render(OrderListSerializer(orders, many=True).data)
+        rows = OrderValuesSerializer().values(orders)
+        self.assertEqual(JSONRenderer().render(OrderValuesSerializer().serialize(rows)), expected)
+
+    def test_users_match_serializer(self):
+        User.objects.filter(pk=self.waiter.pk).update(photo_file='ab/%s.png' % ('ab' * 32))
+        users = User.objects.order_by('id')
+        for fields in [None, UserSerializer.Meta.fields, ['photo', 'id']]:
+            serializer = UserValuesSerializer(fields)
+            self.assertEqual(serializer.serialize(serializer.values(users)),
+                             UserSerializer(users, many=True, fields=fields).data['data'])
+
+    def test_user_list_fallback(self):
+        self.authorize()
+        params = {'fields': ','.join(UserSerializer.Meta.fields), 'page_size': 1}
+        fast = self.client.get('/api-cafe/user', params).json()
+        caching.get_cache().clear()
+        with mock.patch.object(UserList, 'values_serializer_class', None):
+            self.assertEqual(self.client.get('/api-cafe/user', params).json(), fast)
+
+
+class OrderTest(ShiftOrdersTestCase):
+
+    def test_create(self):
+        self.authorize('waiter-token')
+        items = [{'menu_id': self.menus[0].id, 'quantity': 2}, {'menu_id': self.menus[1].id},
+                 {'menu_id': self.menus[0].id}]
+        with self.assertNumQueries(13):
+            response = self.client.post('/api-cafe/order', {'table_id': self.table.id, 'number_of_person': 3,
+                                                            'items': items}, format='json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()['data']
+        self.assertEqual(data['status'], 'Accepted')
+        self.assertEqual(data['shift_workers'], 'waiter')
+        self.assertAlmostEqual(data['price'], 99.9 * 3 + 150.0)
+        self.assertEqual([(position['name'], position['quantity']) for position in data['positions']],
+                         [('Menu 0', 3), ('Menu 1', 1)])
+
+        work_shift = WorkShift.objects.get(pk=self.work_shift.pk)
+        self.assertAlmostEqual(work_shift.total_price, self.work_shift.total_price + 99.9 * 3 + 150.0)
+
+    def test_validation(self):
+        self.authorize('waiter-token')
+        response = self.client.post('/api-cafe/order', {
+            'table_id': self.table.id, 'number_of_person': 2,
+            'items': [{'menu_id': self.menus[0].id}, {'menu_id': 0}, {'menu_id': self.menus[1].id, 'quantity': 0}],
+        }, format='json')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['error']['errors']['items'][2],
+                         {'quantity': ['Ensure this value is greater than or equal to 1.']})
+
+        response = self.client.post('/api-cafe/order', {
+            'table_id': 0, 'number_of_person': 2, 'items': [{'menu_id': 0}]}, format='json')
+        self.assertEqual(response.json()['error']['errors'], {
+            'table_id': ['Invalid pk "0" - object does not exist.'],
+            'items': {'0': {'menu_id': ['Invalid pk "0" - object does not exist.']}},
+        })
+
+    def test_not_on_shift(self):
+        WorkShift.objects.update(active=False)
+        self.authorize('waiter-token')
+        response = self.client.post('/api-cafe/order', {'table_id': self.table.id, 'number_of_person': 2},
+                                    format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_positions(self):
+        order = Order.objects.filter(shift_worker__user=self.waiter, total_price__isnull=True).get()
+        self.authorize('waiter-token')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api-cafe/order/%d/position' % order.id,
+                                        {'items': [{'menu_id': self.menus[1].id, 'quantity': 4}]}, format='json')
+        self.assertEqual(response.json()['data']['price'], 600.0)
+        admin_client = APIClient(HTTP_AUTHORIZATION='Bearer admin-token')
+        etag = admin_client.get('/api-cafe/work-shift/%d/order' % self.work_shift.id)['ETag']
+
+        position_id = response.json()['data']['positions'][0]['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api-cafe/order/%d/position' % order.id,
+                                          {'position_ids': [position_id]}, format='json')
+        self.assertEqual(response.json()['data']['price'], 0)
+        self.assertEqual(response.json()['data']['positions'], [])
+        self.assertIsNone(Order.objects.get(pk=order.pk).total_price)
+        self.assertNotEqual(admin_client.get('/api-cafe/work-shift/%d/order' % self.work_shift.id)['ETag'], etag)
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+    def test_other_waiters_order(self):
+        order = Order.objects.filter(shift_worker__user=self.admin).first()
+        self.authorize('waiter-token')
+        response = self.client.post('/api-cafe/order/%d/position' % order.id,
+                                    {'items': [{'menu_id': self.menus[0].id}]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class RevenueAnalyticsTest(ShiftOrdersTestCase):
+
+    revenue = (99.9 + 249.9 + 250.0 + 250.0) * 2
+
+    def get(self, **params):
+        response = self.client.get('/api-cafe/analytics/revenue', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data']
+
+    def test_group_by(self):
+        self.authorize()
+        with self.assertNumQueries(3):
+            data = self.get(group_by='day')
+        self.assertEqual(len(data['buckets']), 1)
+        self.assertAlmostEqual(data['buckets'][0]['revenue'], self.revenue)
+        self.assertEqual((data['total']['orders'], data['total']['covers']), (10, 20))
+
+        data = self.get(group_by='worker')
+        self.assertEqual({bucket['name']: bucket['orders'] for bucket in data['buckets']}, {'admin': 5, 'waiter': 5})
+        data = self.get(group_by='table')
+        self.assertEqual([bucket['name'] for bucket in data['buckets']], ['Table 1'])
+
+        data = self.get(group_by='menu')
+        self.assertEqual([(bucket['name'], bucket['quantity'], bucket['orders']) for bucket in data['buckets']],
+                         [('Menu 0', 8, 8), ('Menu 1', 6, 6), ('Menu 2', 4, 4)])
+        self.assertEqual(data['total']['orders'], 10)
+        self.assertAlmostEqual(data['total']['revenue'], self.revenue)
+
+        tomorrow = (timezone.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+        self.assertEqual(self.get(group_by='hour', start=tomorrow)['buckets'], [])
+
+    def test_rollups(self):
+        now = timezone.now()
+        WorkShift.objects.filter(pk=self.work_shift.pk).update(active=False, start=now - timedelta(hours=9),
+                                                               end=now - timedelta(hours=1))
+        call_command('rollup_revenue', stdout=StringIO())
+        self.assertEqual(DailyRevenue.objects.count(), 2)
+
+        # the orders of rolled up shifts are not aggregated again
+        Order.objects.update(total_price=1)
+        self.authorize()
+        today = timezone.localdate().strftime('%Y-%m-%d')
+        data = self.get(group_by='day', start=today)
+        self.assertAlmostEqual(data['total']['revenue'], self.revenue)
+        self.assertEqual(data['total']['orders'], 10)
+        self.assertEqual({bucket['name'] for bucket in self.get(group_by='worker')['buckets']}, {'admin', 'waiter'})
+        self.assertEqual(self.get(group_by='hour')['total']['revenue'], 10)
+
+        Order.objects.first().save()
+        self.assertFalse(DailyRevenue.objects.exists())
+        self.assertEqual(self.get(group_by='day', start=today)['total']['revenue'], 10)
+
+    def test_validation(self):
+        self.authorize()
+        response = self.client.get('/api-cafe/analytics/revenue', {'group_by': 'week'})
+        self.assertEqual(response.status_code, 422)
+
+
+class ReportJobTest(ShiftOrdersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = self.settings(API_REPORTS_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def submit(self, kind='orders', **params):
+        return self.client.post('/api-cafe/report-job', {'kind': kind, 'params': params}, format='json')
+
+    def test_submit_and_download(self):
+        self.authorize()
+        response = self.submit(type='csv', work_shift_id=self.work_shift.id, ignored='value')
+        self.assertEqual(response.status_code, 202)
+        job = response.json()['data']
+        self.assertEqual((job['status'], job['params'], job['download']),
+                         ('queued', {'type': 'csv', 'work_shift_id': self.work_shift.id}, None))
+
+        # identical in-flight reports are deduplicated
+        response = self.submit(work_shift_id=self.work_shift.id, type='csv')
+        self.assertEqual((response.status_code, response.json()['data']['id']), (200, job['id']))
+        self.assertEqual(self.submit(type='ndjson').status_code, 202)
+        self.assertEqual(self.client.get('/api-cafe/report-job/%d/download' % job['id']).status_code, 409)
+
+        run_job(ReportJob.claim('test'))
+        job = self.client.get('/api-cafe/report-job/%d' % job['id']).json()['data']
+        self.assertEqual((job['status'], job['progress']), ('done', 100))
+        response = self.client.get(job['download'])
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(content, ''.join(OrderExport(Order.objects.all()).stream('csv')))
+
+        # a finished report can be requested again
+        self.assertEqual(self.submit(type='csv', work_shift_id=self.work_shift.id).status_code, 202)
+
+    def test_expired_file(self):
+        self.authorize()
+        job_id = self.submit(kind='revenue').json()['data']['id']
+        run_job(ReportJob.claim('test'))
+        report_storage.delete(ReportJob.objects.get(pk=job_id).file_name)
+
+        response = self.client.get('/api-cafe/report-job/%d/download' % job_id)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['error']['message'], 'The report file no longer exists')
+        job = self.client.get('/api-cafe/report-job/%d' % job_id).json()['data']
+        self.assertEqual((job['status'], job['download']), ('expired', None))
+
+    def test_validation(self):
+        self.authorize()
+        response = self.submit(kind='users')
+        self.assertEqual(response.status_code, 422)
+        response = self.submit(kind='revenue', group_by='week')
+        self.assertEqual(list(response.json()['error']['errors']['params']), ['group_by'])
+
+    def test_cancel(self):
+        self.authorize()
+        queued = self.submit(kind='revenue').json()['data']
+        running = self.submit(kind='revenue', group_by='menu').json()['data']
+        response = self.client.post('/api-cafe/report-job/%d/cancel' % queued['id'])
+        self.assertEqual(response.json()['data']['status'], 'cancelled')
+        self.assertEqual(self.client.post('/api-cafe/report-job/%d/cancel' % queued['id']).status_code, 403)
+
+        job = ReportJob.claim('test')
+        self.assertEqual(job.id, running['id'])
+        self.client.post('/api-cafe/report-job/%d/cancel' % job.id)
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.file_name), ('cancelled', ''))
+        self.assertEqual(os.listdir(report_storage.location), [])
+
+    def test_requeue_stale(self):
+        self.authorize()
+        self.submit(kind='revenue')
+        job = ReportJob.claim('test')
+        ReportJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(ReportJob.requeue_stale(60), 1)
+        self.assertEqual(ReportJob.claim('other').pk, job.pk)
+
+    def test_stale_run_after_requeue(self):
+        self.authorize()
+        self.submit(kind='revenue')
+        stale = ReportJob.claim('test')
+        ReportJob.objects.filter(pk=stale.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        ReportJob.requeue_stale(60)
+        # the same worker process claims the job again
+        current = ReportJob.claim('test')
+
+        run_job(stale)
+        self.assertEqual(ReportJob.objects.get(pk=current.pk).status, 'running')
+        run_job(current)
+        job = ReportJob.objects.get(pk=current.pk)
+        self.assertEqual((job.status, job.worker), ('done', current.worker))
+        self.assertEqual(os.listdir(report_storage.location), [job.file_name])
+
+
+@override_settings(API_DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(CafeTestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # an empty local replica, rows written in the tests only reach the primary
+        connections.databases['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+        with override_settings(API_DATABASE_REPLICAS=['replica']):
+            call_command('migrate', database='replica', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+
+    def setUp(self):
+        super().setUp()
+        expires_at = timezone.now() + timedelta(days=1)
+        ApiToken.objects.create(user=self.admin, key_hash=ApiToken.hash_key('other-token'), expires_at=expires_at)
+        self.other_client = APIClient(HTTP_AUTHORIZATION='Bearer other-token')
+
+    def get_logins(self, client, path='/api-cafe/user'):
+        return [user['login'] for user in client.get(path).json()['data']]
+
+    def test_safe_reads_use_replica(self):
+        self.authorize()
+        self.assertEqual(self.get_logins(self.client), [])
+        self.assertEqual(User.objects.all().db, 'default')
+
+    def test_client_reads_own_writes(self):
+        self.authorize()
+        response = self.client.post('/api-cafe/user', {'login': 'new', 'password': 'secret',
+                                                       'role_id': self.waiter_role.id})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('new', self.get_logins(self.client))
+
+        # other clients read the changed users from the primary too ...
+        self.assertIn('new', self.get_logins(self.other_client))
+        # ... until the replicas caught up, the client that wrote still reads from the primary
+        caching.get_cache().delete('changed:%s' % caching.USERS)
+        self.assertEqual(self.get_logins(self.other_client, '/api-cafe/user?fields=login'), [])
+        self.assertIn('new', self.get_logins(self.client, '/api-cafe/user?fields=id,login'))
+
+    def test_write_on_get_uses_primary(self):
+        self.authorize()
+        work_shift = WorkShift.objects.create(start=timezone.now(), end=timezone.now() + timedelta(hours=8))
+        response = self.client.get('/api-cafe/work-shift/%d/open' % work_shift.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(WorkShift.objects.get(pk=work_shift.pk).active)
+
+    def test_async_requests(self):
+        get = async_to_sync(AsyncClient().get)
+        self.assertEqual(get('/api-cafe/async/user', authorization='Bearer admin-token').json()['data'], [])
+
+        self.authorize()
+        self.client.post('/api-cafe/user', {'login': 'new', 'password': 'secret', 'role_id': self.waiter_role.id})
+        caching.get_cache().delete('changed:%s' % caching.USERS)
+        # the pin reaches the other workers through the api cache
+        other = type(caching.get_cache())(settings.CACHES[settings.API_RESPONSE_CACHE]['LOCATION'], {})
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION='Bearer admin-token')
+        self.assertTrue(other.get(ReplicaRoutingMiddleware(None).get_client_key(request)))
+        response = get('/api-cafe/async/user?fields=login', authorization='Bearer admin-token')
+        self.assertIn('new', [user['login'] for user in response.json()['data']])
+
+    @override_settings(API_DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        self.authorize()
+        self.assertEqual(self.get_logins(self.client), ['admin', 'waiter'])
+
+
+class ReferenceDataTest(ShiftOrdersTestCase):
+
+    def test_lookups_without_queries(self):
+        request = APIRequestFactory().get('/api-cafe/user')
+        request.user = self.admin
+        with self.assertNumQueries(0):
+            self.assertTrue(IsAdmin().has_permission(request, None))
+            self.assertEqual(reference_data.get('menus', self.menus[0].id).price, 99.9)
+
+        Status.objects.filter(pk=self.status.pk).update(name='Paid up')
+        with self.assertNumQueries(1):
+            orders = ShiftOrdersReport(self.work_shift).data['orders']
+        self.assertEqual(orders[0]['status'], 'Accepted')
+
+    def test_invalidated_by_signals(self):
+        self.table.name = 'Terrace'
+        self.table.save()
+        self.assertEqual(ShiftOrdersReport(self.work_shift).data['orders'][0]['table'], 'Terrace')
+
+        table = Table.objects.bulk_create([Table(name='Bar', capacity=2)])[0]
+        self.assertEqual(reference_data.get('tables', Table.objects.get(name='Bar').pk).name, table.name)
+
+    def test_version_from_other_process(self):
+        other = ReferenceData()
+        other.load()
+        Status.objects.filter(pk=self.status.pk).update(name='Paid up')
+        with self.captureOnCommitCallbacks(execute=True):
+            reference_data.invalidate()
+        self.assertEqual(other.get('statuses', self.status.pk).name, 'Accepted')
+        with self.settings(API_REFERENCE_DATA_CHECK_INTERVAL=0):
+            self.assertEqual(other.get('statuses', self.status.pk).name, 'Paid up')
+
+    def test_unknown_keys(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(reference_data.get('tables', 0))
+            self.assertIsNone(reference_data.get('tables', 0))
+
+        table = Table.objects.bulk_create([Table(name='Bar', capacity=2)])[0]
+        table_id = Table.objects.get(name='Bar').pk
+        with self.assertNumQueries(1):
+            self.assertEqual(reference_data.get('tables', table_id).name, table.name)
+            self.assertEqual(reference_data.get('tables', table_id).name, table.name)
+            self.assertIn(table_id, reference_data.all('tables'))
+
+
+class JSONRendererTest(ShiftOrdersTestCase):
+
+    def test_matches_stdlib(self):
+        now = timezone.now()
+        payloads = [
+            {'data': ShiftOrdersReport(self.work_shift).data},
+            {'data': ShiftOrdersSerializer(self.work_shift).data},
+            [now, now.replace(microsecond=0), now.replace(tzinfo=None), now.date(), now.time(),
+             Decimal('10.50'), gettext_lazy('Forbidden'), 'line\u2028separator', 99.9, None, True],
+            # non-string keys are rendered by the stdlib path
+            {1: 'one'},
+        ]
+        for data in payloads:
+            self.assertEqual(renderers.JSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(JSONRenderer().render({'a': 1}, 'application/json; indent=2'), b'{\n  "a": 1\n}')
+
+    def test_parser(self):
+        content = '{"name": "Кафе", "items": [1, 2.5, null]}'.encode()
+        self.assertEqual(JSONParser().parse(BytesIO(content)), {'name': 'Кафе', 'items': [1, 2.5, None]})
+        with self.assertRaisesMessage(ParseError, 'JSON parse error'):
+            JSONParser().parse(BytesIO(b'{"name":'))
+        with mock.patch('api.parsers.orjson', None):
+            self.assertEqual(JSONParser().parse(BytesIO(content)), {'name': 'Кафе', 'items': [1, 2.5, None]})
+
+    def test_without_orjson(self):
+        data = {'data': ShiftOrdersReport(self.work_shift).data}
+        expected = renderers.JSONRenderer().render(data)
+        with mock.patch('api.renderers.orjson', None):
+            self.assertEqual(JSONRenderer().render(data), expected)
+
+
+class OrderExportTest(ShiftOrdersTestCase):
+
+    def test_ndjson(self):
+        self.authorize()
+        response = self.client.get('/api-cafe/work-shift/%d/order/export' % self.work_shift.id)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        report = ShiftOrdersReport(self.work_shift).data
+        self.assertEqual(sorted(row['id'] for row in rows), sorted(order['id'] for order in report['orders']))
+        self.assertAlmostEqual(sum(row['price'] for row in rows), report['amount_for_all'])
+
+    def test_csv_date_range(self):
+        self.authorize()
+        OrderExport.chunk_size = 3
+        self.addCleanup(setattr, OrderExport, 'chunk_size', 2000)
+        response = self.client.get('/api-cafe/work-shift/order/export', {'type': 'csv', 'start': '2000-01-01'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(OrderExport.fields))
+        self.assertEqual(len(lines), 11)
+
+        response = self.client.get('/api-cafe/work-shift/order/export', {'type': 'csv', 'end': '2000-01-01'})
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 1)
+
+    def test_invalid_type(self):
+        self.authorize()
+        response = self.client.get('/api-cafe/work-shift/order/export', {'type': 'xml'})
+        self.assertEqual(response.status_code, 422)
+
+
+class ConditionalGetTest(ShiftOrdersTestCase):
+
+    def test_work_shift_orders(self):
+        self.authorize()
+        url = '/api-cafe/work-shift/%d/order' % self.work_shift.id
+        response = self.client.get(url)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.json()['data']['id'], self.work_shift.id)
+
+        order = Order.objects.filter(shift_worker__work_shift=self.work_shift).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderMenu.objects.create(order=order, menu=self.menus[0])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_zero_padded_id(self):
+        self.authorize()
+        url = '/api-cafe/work-shift/0%d/order' % self.work_shift.id
+        etag = self.client.get(url)['ETag']
+        order = Order.objects.filter(shift_worker__work_shift=self.work_shift).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderMenu.objects.create(order=order, menu=self.menus[0])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_user_list(self):
+        self.authorize()
+        etag = self.client.get('/api-cafe/user')['ETag']
+        self.assertNotEqual(self.client.get('/api-cafe/user', {'fields': 'id'})['ETag'], etag)
+        self.assertEqual(self.client.get('/api-cafe/user', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.waiter.name = 'cook'
+            self.waiter.save()
+        response = self.client.get('/api-cafe/user', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()['data'][1]['name'], 'cook')
+
+
+class SharedCacheTest(CafeTestCase):
+
+    def test_versions_reach_other_processes(self):
+        # a cache of another worker process, reading the same location
+        cache = caching.get_cache()
+        other = type(cache)(settings.CACHES[settings.API_RESPONSE_CACHE]['LOCATION'], {})
+        version = caching.get_versions([caching.USERS])[0]
+        self.assertEqual(other.get('version:%s' % caching.USERS), version)
+        with self.captureOnCommitCallbacks(execute=True):
+            caching.bump_versions([caching.USERS])
+        self.assertNotEqual(other.get('version:%s' % caching.USERS), version)
+
+    def test_process_local_cache_warning(self):
+        self.assertEqual(check_api_cache(None), [])
+        with self.settings(CACHES=dict(settings.CACHES, api={
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'})):
+            self.assertEqual([warning.id for warning in check_api_cache(None)], ['api.W001'])
+
+
+class RollupTest(ShiftOrdersTestCase):
+
+    def test_totals(self):
+        self.assertAlmostEqual(self.work_shift.get_price(), 2 * (99.9 * 4 + 150.0 * 3 + 0.1 * 2))
+        order = Order.objects.filter(shift_worker__work_shift=self.work_shift).last()
+        self.assertAlmostEqual(order.get_price(), 99.9 + 150.0 + 0.1)
+
+    def test_menu_price_change(self):
+        menu = self.menus[1]
+        menu.price = 200.0
+        menu.save()
+        self.work_shift.refresh_from_db()
+        self.assertAlmostEqual(self.work_shift.get_price(), 2 * (99.9 * 4 + 200.0 * 3 + 0.1 * 2))
+
+    def test_order_menu_delete(self):
+        OrderMenu.objects.filter(menu=self.menus[0]).delete()
+        self.work_shift.refresh_from_db()
+        self.assertAlmostEqual(self.work_shift.get_price(), 2 * (150.0 * 3 + 0.1 * 2))
+        self.assertEqual(Order.objects.filter(total_price__isnull=True).count(), 4)
+
+    def test_rebuild_command(self):
+        Order.objects.update(total_price=None)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', '--check', stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.work_shift.refresh_from_db()
+        self.assertAlmostEqual(self.work_shift.get_price(), 2 * (99.9 * 4 + 150.0 * 3 + 0.1 * 2))
+
+
+class UserListTest(CafeTestCase):
+
+    def test_list(self):
+        self.authorize()
+        with self.assertNumQueries(2):
+            response = self.client.get('/api-cafe/user')
+        self.assertEqual(response.json(), {
+            'data': [
+                {'id': self.admin.id, 'name': 'admin', 'login': 'admin', 'status': 'working',
+                 'group': 'Administrator'},
+                {'id': self.waiter.id, 'name': 'waiter', 'login': 'waiter', 'status': 'working',
+                 'group': 'Waiter'},
+            ],
+            'next': None,
+        })
+
+    def test_keyset_pagination(self):
+        self.authorize()
+        response = self.client.get('/api-cafe/user', {'page_size': 1})
+        self.assertEqual([user['id'] for user in response.json()['data']], [self.admin.id])
+
+        response = self.client.get(response.json()['next'])
+        self.assertEqual([user['id'] for user in response.json()['data']], [self.waiter.id])
+        self.assertIsNone(response.json()['next'])
+
+    def test_fields(self):
+        self.authorize()
+        response = self.client.get('/api-cafe/user', {'fields': 'id,group'})
+        self.assertEqual(response.json()['data'][0], {'id': self.admin.id, 'group': 'Administrator'})
+
+        response = self.client.get('/api-cafe/user', {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['error']['errors'], {'fields': ['Unknown field: password']})
+
+
+class ShiftWorkerBulkTest(CafeTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        cls.work_shifts = [WorkShift.objects.create(start=now, end=now + timedelta(hours=8)) for _ in range(2)]
+        ShiftWorker.objects.create(user=cls.admin, work_shift=cls.work_shifts[0])
+
+    def test_shift_users(self):
+        self.authorize()
+        response = self.client.post('/api-cafe/work-shift/%d/users' % self.work_shifts[0].id,
+                                    {'user_ids': [self.admin.id, self.waiter.id, self.waiter.id]}, format='json')
+        self.assertEqual([item['status'] for item in response.json()['data']],
+                         ['already on shift', 'added', 'already on shift'])
+        self.assertEqual(self.work_shifts[0].workers.count(), 2)
+
+    def test_bulk_users(self):
+        self.authorize()
+        workers = [
+            {'work_shift_id': self.work_shifts[0].id, 'user_id': self.waiter.id},
+            {'work_shift_id': self.work_shifts[1].id, 'user_id': self.admin.id},
+            {'work_shift_id': self.work_shifts[1].id, 'user_id': 0},
+            {'work_shift_id': 0, 'user_id': self.admin.id},
+        ]
+        # token, shifts, users, existing workers, savepoint + insert + release
+        with self.assertNumQueries(7):
+            response = self.client.post('/api-cafe/work-shift/users', {'workers': workers}, format='json')
+        self.assertEqual([item['status'] for item in response.json()['data']],
+                         ['added', 'added', 'user not found', 'work shift not found'])
+        self.assertEqual(ShiftWorker.objects.count(), 3)
+
+    def test_concurrent_add(self):
+        self.authorize()
+        # another request added the waiter after this one checked the existing workers
+        ShiftWorker.objects.create(user=self.waiter, work_shift=self.work_shifts[1])
+        checks = [ShiftWorker.objects.none()]
+        real_filter = ShiftWorker.objects.filter
+
+        def filter_workers(*args, **kwargs):
+            return checks.pop() if checks else real_filter(*args, **kwargs)
+
+        workers = [{'work_shift_id': self.work_shifts[1].id, 'user_id': user.id} for user in [self.waiter, self.admin]]
+        with mock.patch.object(ShiftWorker.objects, 'filter', side_effect=filter_workers):
+            response = self.client.post('/api-cafe/work-shift/users', {'workers': workers}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['status'] for item in response.json()['data']], ['already on shift', 'added'])
+        self.assertEqual(self.work_shifts[1].workers.count(), 2)
+
+    def test_validation(self):
+        self.authorize()
+        response = self.client.post('/api-cafe/work-shift/users', {'workers': []}, format='json')
+        self.assertEqual(response.status_code, 422)
+
+
+class UserImportTest(CafeTestCase):
+
+    def test_json(self):
+        self.authorize()
+        users = [{'name': 'user%d' % i, 'login': 'user%d' % i, 'password': 'secret', 'role_id': self.waiter_role.id}
+                 for i in range(5)]
+        # token, roles, login check, savepoint + insert + release
+        with self.assertNumQueries(6):
+            response = self.client.post('/api-cafe/user/import', users, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['data']['count'], 5)
+        self.assertEqual(User.objects.filter(role=self.waiter_role).count(), 6)
+
+    def test_csv(self):
+        self.authorize()
+        upload = SimpleUploadedFile('users.csv', b'name,login,password,role_id\n'
+                                                 b'cook,cook,secret,%d\n' % self.waiter_role.id)
+        response = self.client.post('/api-cafe/user/import', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(User.objects.filter(login='cook').exists())
+
+    def test_row_errors(self):
+        self.authorize()
+        users = [
+            {'login': 'new', 'password': 'secret', 'role_id': self.waiter_role.id},
+            {'login': 'other', 'password': 'secret', 'role_id': 0},
+        ]
+        response = self.client.post('/api-cafe/user/import', users, format='json')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(list(response.json()['error']['errors']), ['1'])
+
+        users[1] = {'login': 'admin', 'password': 'secret', 'role_id': self.waiter_role.id}
+        response = self.client.post('/api-cafe/user/import', users, format='json')
+        self.assertEqual(response.json()['error']['errors'], {'1': {'login': ['user with this login already exists.']}})
+        self.assertFalse(User.objects.filter(login='new').exists())
+
+        users[1] = {'login': 'New', 'password': 'secret', 'role_id': self.waiter_role.id}
+        response = self.client.post('/api-cafe/user/import', users, format='json')
+        self.assertEqual(list(response.json()['error']['errors']), ['1'])
+
+    def test_concurrent_import(self):
+        self.authorize()
+        users = [{'login': 'new', 'password': 'secret', 'role_id': self.waiter_role.id}]
+        # another request created the login after the validation
+        with mock.patch.object(User.objects, 'bulk_create', side_effect=IntegrityError):
+            response = self.client.post('/api-cafe/user/import', users, format='json')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['error']['errors'], {'login': ['user with this login already exists.']})
+
+    @override_settings(API_IMPORT_BATCH_SIZE=2)
+    def test_batch_size(self):
+        self.authorize()
+        users = [{'login': 'user%d' % i, 'password': 'secret', 'role_id': self.waiter_role.id} for i in range(5)]
+        # token, roles, login check, savepoint + 3 inserts + release
+        with self.assertNumQueries(8):
+            response = self.client.post('/api-cafe/user/import', users, format='json')
+        self.assertEqual(response.status_code, 201)
+
+
+class AsyncViewsTest(ShiftOrdersTestCase):
+
+    async def test_user_list(self):
+        response = await AsyncClient().get('/api-cafe/async/user', authorization='Bearer admin-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)['data']), 2)
+
+    async def test_permissions(self):
+        response = await AsyncClient().get('/api-cafe/async/user', authorization='Bearer waiter-token')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(json.loads(response.content)['error']['message'], 'Forbidden for you')
+
+    def test_reference_data_reload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            reference_data.invalidate()
+        response = async_to_sync(AsyncClient().get)('/api-cafe/async/user', authorization='Bearer admin-token')
+        self.assertEqual(response.status_code, 200)
+
+    def test_work_shift_orders(self):
+        self.authorize()
+        expected = self.client.get('/api-cafe/work-shift/%d/order' % self.work_shift.id).content
+        response = async_to_sync(AsyncClient().get)('/api-cafe/async/work-shift/%d/order' % self.work_shift.id,
+                                                    authorization='Bearer admin-token')
+        self.assertEqual(response.content, expected)
+
+        response = async_to_sync(AsyncClient().get)('/api-cafe/async/work-shift/0/order',
+                                                    authorization='Bearer admin-token')
+        self.assertEqual(response.status_code, 404)
+
+
+class OrderFeedTest(ShiftOrdersTestCase):
+
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': '/api-cafe/events/order',
+        'query_string': b'',
+        'headers': [(b'authorization', b'Bearer waiter-token')],
+    }
+
+    def create_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api-cafe/order', {'table_id': self.table.id, 'number_of_person': 2,
+                                                 'items': [{'menu_id': self.menus[1].id}]}, format='json')
+
+    async def test_feed(self):
+        communicator = ApplicationCommunicator(asgi.application, self.scope)
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output(1)
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        self.assertEqual((await communicator.receive_output(1))['body'], b'retry: 3000\n\n')
+
+        self.authorize('waiter-token')
+        await sync_to_async(self.create_order)()
+        frame = (await communicator.receive_output(1))['body'].decode()
+        self.assertIn('event: order.created\n', frame)
+        data = json.loads(frame.split('data: ', 1)[1])
+        self.assertEqual((data['shift_workers'], data['status'], data['price']), ('waiter', 'Accepted', 150.0))
+
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(1)
+        self.assertFalse(hub.has_subscribers())
+
+    async def test_login_required(self):
+        communicator = ApplicationCommunicator(asgi.application, dict(self.scope, headers=[]))
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        self.assertEqual((await communicator.receive_output(1))['status'], 403)
+        body = (await communicator.receive_output(1))['body']
+        self.assertEqual(json.loads(body)['error']['message'], 'Login failed')
+
+    async def test_slow_consumer_dropped(self):
+        with self.settings(API_EVENTS_QUEUE_SIZE=2):
+            fast = hub.subscribe(self.work_shift.id)
+            slow = hub.subscribe(self.work_shift.id)
+        try:
+            for i in range(4):
+                hub.publish(self.work_shift.id, events.ORDER_UPDATED, {'id': i})
+                await asyncio.sleep(0)
+                self.assertIn(b'"id":%d' % i, await fast.queue.get())
+            self.assertTrue(slow.dropped)
+            self.assertIs(await slow.queue.get(), events.DROPPED)
+        finally:
+            hub.unsubscribe(fast)
+            hub.unsubscribe(slow)
+
+
+class ConnectionPoolTest(TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool(max_size=2, max_age=60, timeout=0.01)
+        self.factory = partial(sqlite3.connect, ':memory:', check_same_thread=False)
+
+    def test_reuse(self):
+        connection = self.pool.checkout(self.factory)
+        self.pool.checkin(connection)
+        self.assertIs(self.pool.checkout(self.factory), connection)
+        self.assertEqual(self.pool.stats()['created'], 1)
+        self.assertEqual(self.pool.stats()['reused'], 1)
+
+    def test_max_size(self):
+        connections = [self.pool.checkout(self.factory) for _ in range(2)]
+        with self.assertRaises(PoolTimeout):
+            self.pool.checkout(self.factory)
+        self.pool.checkin(connections[0])
+        self.assertIs(self.pool.checkout(self.factory), connections[0])
+
+    def test_health_check(self):
+        connection = self.pool.checkout(self.factory)
+        self.pool.checkin(connection)
+        connection.close()
+        self.assertIsNot(self.pool.checkout(self.factory), connection)
+        self.assertEqual(self.pool.stats()['discarded'], 1)
+
+    def test_max_age(self):
+        self.pool.max_age = 0
+        connection = self.pool.checkout(self.factory)
+        self.pool.checkin(connection)
+        self.assertIsNot(self.pool.checkout(self.factory), connection)
+
+    def test_database_wrapper(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_dict = dict(connection.settings_dict, ENGINE='api.backends.sqlite3',
+                             NAME=os.path.join(directory.name, 'pool.sqlite3'), POOL={'MAX_SIZE': 1})
+        wrapper = load_backend('api.backends.sqlite3').DatabaseWrapper(settings_dict, alias='pool-test')
+        self.addCleanup(pools.pop, 'pool-test')
+        wrapper.ensure_connection()
+        raw_connection = wrapper.connection
+        wrapper.close()
+        wrapper.ensure_connection()
+        self.assertIs(wrapper.connection, raw_connection)
+        self.assertEqual(get_pool_stats()['pool-test']['in_use'], 1)
+        wrapper.close()
+        pools['pool-test'].close()
+
+    def test_database_change(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_dict = dict(connection.settings_dict, ENGINE='api.backends.sqlite3',
+                             NAME=os.path.join(directory.name, 'real.sqlite3'))
+        wrapper = load_backend('api.backends.sqlite3').DatabaseWrapper(settings_dict, alias='pool-test')
+        self.addCleanup(pools.pop, 'pool-test')
+        with wrapper.cursor() as cursor:
+            cursor.execute('CREATE TABLE real_table (id integer)')
+        wrapper.close()
+        real_pool = pools['pool-test']
+
+        # like the test runner, which switches NAME to the test database
+        wrapper.settings_dict['NAME'] = os.path.join(directory.name, 'test.sqlite3')
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE name = 'real_table'")
+            self.assertEqual(cursor.fetchall(), [])
+        wrapper.close()
+        self.assertIsNot(pools['pool-test'], real_pool)
+        self.assertEqual(real_pool.stats()['idle'], 0)
+        pools['pool-test'].close()
+
+
+class ConstraintTest(TestCase):
+
+    def test_single_active_shift(self):
+        now = timezone.now()
+        WorkShift.objects.create(start=now, end=now + timedelta(hours=8), active=True)
+        WorkShift.objects.create(start=now, end=now + timedelta(hours=8))
+        with self.assertRaises(IntegrityError):
+            WorkShift.objects.create(start=now, end=now + timedelta(hours=8), active=True)
+
+
+class PhotoTest(CafeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get_photo(self):
+        content = BytesIO()
+        Image.new('RGB', (800, 600), 'red').save(content, 'PNG')
+        return SimpleUploadedFile('photo.png', content.getvalue(), content_type='image/png')
+
+    def wait_for_variants(self):
+        photos.executor.shutdown(wait=True)
+        photos.executor = None
+
+    def test_upload(self):
+        self.authorize()
+        for login in ['first', 'second']:
+            response = self.client.post('/api-cafe/user', {
+                'login': login, 'password': 'secret', 'role_id': self.waiter_role.id, 'photo_file': self.get_photo()
+            }, format='multipart')
+            self.assertEqual(response.status_code, 201)
+        self.wait_for_variants()
+
+        first, second = User.objects.filter(login__in=['first', 'second']).order_by('id')
+        self.assertEqual(first.photo_file.name, second.photo_file.name)
+        self.assertRegex(first.photo_file.name, r'^[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        with Image.open(photos.photo_storage.path(photos.get_variant_name(first.photo_file.name, 'thumb'))) as image:
+            self.assertEqual(image.size, (128, 96))
+
+        response = self.client.get('/api-cafe/user', {'fields': 'login,photo'})
+        self.assertEqual(response.json()['data'][0], {'login': 'admin', 'photo': None})
+        self.assertEqual(set(response.json()['data'][2]['photo']), {'original', 'thumb', 'medium'})
+
+
+class MetricsTest(CafeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+
+    def test_metrics(self):
+        self.authorize()
+        self.client.get('/api-cafe/user')
+        with self.assertLogs('api.metrics', 'WARNING'), self.settings(API_QUERY_BUDGET=0):
+            self.client.get('/api-cafe/user', {'fields': 'id'})
+
+        content = self.client.get('/metrics').content.decode()
+        labels = 'route="api-cafe/user",method="GET"'
+        self.assertIn('api_request_duration_seconds_count{%s} 2' % labels, content)
+        self.assertIn('api_db_queries_total{%s} 3' % labels, content)
+        self.assertIn('api_query_budget_exceeded_total{%s} 1' % labels, content)
+
+    def test_async_requests(self):
+        response = async_to_sync(AsyncClient().get)('/api-cafe/async/user', authorization='Bearer admin-token')
+        self.assertEqual(response.status_code, 200)
+        self.authorize()
+        content = self.client.get('/metrics').content.decode()
+        labels = 'route="api-cafe/async/user",method="GET"'
+        self.assertIn('api_request_duration_seconds_count{%s} 1' % labels, content)
+        self.assertIn('api_db_queries_total{%s} 2' % labels, content)
+
+    def test_admin_only(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.authorize('waiter-token')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+
+class BenchmarkTest(TestCase):
+
+    def test_seed_and_benchmark(self):
+        call_command('seed_cafe', stdout=StringIO())
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(WorkShift.objects.count(), 30)
+        self.assertEqual(Order.objects.count(), 30 * 40)
+        self.assertFalse(Order.objects.filter(total_price__isnull=True).exists())
+
+        with tempfile.TemporaryDirectory() as directory, self.settings(API_REPORTS_ROOT=directory):
+            output = os.path.join(directory, 'baseline.json')
+            call_command('benchmark', iterations=2, output=output, stdout=StringIO())
+            with open(output) as report:
+                results = json.load(report)['results']
+            self.assertEqual(results['work shift orders']['status'], 200)
+            self.assertEqual([results[name]['status'] for name in ['order position add', 'order position delete',
+                                                                     'report job create', 'report job status',
+                                                                     'report job download']],
+                             [201, 200, 202, 200, 200])
+            self.assertEqual(os.listdir(directory), ['baseline.json'])
+
+            results['work shift orders']['queries'] = 0
+            with open(output, 'w') as baseline:
+                json.dump({'results': results}, baseline)
+            with self.assertRaisesMessage(CommandError, '1 endpoints regressed'):
+                call_command('benchmark', iterations=2, baseline=output, tolerance=1000,
+                             stdout=StringIO(), stderr=StringIO())
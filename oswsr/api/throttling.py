@@ -0,0 +1,212 @@
+"""
+Per-client rate limits and per-route load shedding, both held in process.
+
+The throttles keep a token bucket per client: it holds up to the number of
+requests of the rate and refills continuously, so a client can burst up to
+the full rate and is then limited to its average. Buckets are per process,
+with several workers the effective limit is the rate times the workers.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from .exceptions import CafeAPIException, CafeThrottledException
+from .renderers import JSONRenderer
+from .utilities import get_bearer_token
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+class TokenBucketStore:
+    """
+    In-process token buckets by key.
+
+    The least recently used bucket is dropped once ``max_size`` keys are
+    held, its client starts again with a full bucket.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, capacity):
+        """Takes a token from the bucket. Returns ``(allowed, wait)``, the seconds until the next token."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+bucket_store = TokenBucketStore(max_size=getattr(settings, 'API_THROTTLE_STORE_SIZE', 10000))
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle of the ``scope`` rate of ``DEFAULT_THROTTLE_RATES``, e.g. ``'600/min'``."""
+
+    scope = None
+    store = bucket_store
+
+    def __init__(self):
+        self.wait_time = None
+
+    def get_rate(self):
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if rate is None:
+            return None
+        requests, period = rate.split('/')
+        return int(requests), DURATIONS[period[0]]
+
+    def get_cache_key(self, request, view):
+        raise NotImplementedError('.get_cache_key() must be overridden')
+
+    def allow_request(self, request, view):
+        rate = self.get_rate()
+        key = self.get_cache_key(request, view)
+        if rate is None or key is None:
+            return True
+        requests, duration = rate
+        allowed, self.wait_time = self.store.consume(key, requests / duration, requests)
+        return allowed
+
+    def wait(self):
+        return self.wait_time
+
+
+class BearerTokenThrottle(TokenBucketThrottle):
+    """Limits every client by its bearer token, valid or not, and requests without one by address."""
+
+    scope = 'token'
+
+    def get_cache_key(self, request, view):
+        token = get_bearer_token(request)
+        if token is None:
+            return '%s:address:%s' % (self.scope, self.get_ident(request))
+        return '%s:%s' % (self.scope, hashlib.sha1(token.encode()).hexdigest())
+
+
+class LoginThrottle(TokenBucketThrottle):
+    """Limits the login attempts of an address."""
+
+    scope = 'login'
+
+    def get_cache_key(self, request, view):
+        return '%s:%s' % (self.scope, self.get_ident(request))
+
+
+def check_throttles(request, view, throttle_classes=None):
+    """Raises the api 429 error when a throttle rejects the request, for views outside DRF's ``APIView``."""
+    if throttle_classes is None:
+        throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    for throttle_class in throttle_classes:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, view):
+            raise CafeThrottledException(throttle.wait())
+
+
+class ConcurrencyLimiter:
+    """Counts the requests in flight per route."""
+
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, route, limit):
+        with self._lock:
+            in_flight = self._in_flight.get(route, 0)
+            if in_flight >= limit:
+                return False
+            self._in_flight[route] = in_flight + 1
+            return True
+
+    def release(self, route):
+        with self._lock:
+            self._in_flight[route] -= 1
+            if not self._in_flight[route]:
+                del self._in_flight[route]
+
+    def in_flight(self, route):
+        with self._lock:
+            return self._in_flight.get(route, 0)
+
+
+concurrency_limiter = ConcurrencyLimiter()
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    Sheds load per route: a request over ``API_CONCURRENCY_LIMIT`` requests
+    in flight on its route gets an immediate 503 instead of queueing behind
+    them. ``API_CONCURRENCY_LIMITS`` overrides the limit of single routes.
+
+    Under ASGI the middleware stays async and holds the slot of a request
+    until its awaited response is ready, so async views count while they run.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # tells Django the middleware is called as a coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def get_limit(self, route):
+        limits = getattr(settings, 'API_CONCURRENCY_LIMITS', {})
+        return limits.get(route, getattr(settings, 'API_CONCURRENCY_LIMIT', None))
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        try:
+            return self.get_response(request)
+        finally:
+            self.release(request)
+
+    async def __acall__(self, request):
+        try:
+            return await self.get_response(request)
+        finally:
+            self.release(request)
+
+    def release(self, request):
+        route = getattr(request, '_concurrency_route', None)
+        if route is not None:
+            # a streaming response frees its slot before its content is sent
+            concurrency_limiter.release(route)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        route = request.resolver_match.route
+        limit = self.get_limit(route)
+        if limit is None:
+            return None
+        if not concurrency_limiter.acquire(route, limit):
+            exc = CafeAPIException(message='Service unavailable. Too many requests in progress!',
+                                   code=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response = HttpResponse(JSONRenderer().render(exc.detail), status=exc.status_code,
+                                    content_type='application/json')
+            response['Retry-After'] = '1'
+            return response
+        request._concurrency_route = route
+        return None
@@ -1,15 +1,25 @@
 from django.urls import path, include
 from rest_framework import routers
 
-from . import views
+from . import views, async_views
 
 router = routers.SimpleRouter(trailing_slash=False)
 router.register(r'work-shift', views.WorkShiftViewSet)
+router.register(r'report-job', views.ReportJobViewSet)
 
 urlpatterns = [
     path('login', views.login),
     path('logout', views.logout),
     # admin functions
+    path('db-pool', views.db_pool),
     path('user', views.UserList.as_view()),
-    path('', include(router.urls))
+    path('user/import', views.UserImport.as_view()),
+    path('analytics/revenue', views.RevenueAnalytics.as_view()),
+    path('', include(router.urls)),
+    # waiter functions
+    path('order', views.OrderCreate.as_view()),
+    path('order/<int:pk>/position', views.OrderPositions.as_view()),
+    # async read endpoints for the ASGI application
+    path('async/user', async_views.user_list),
+    path('async/work-shift/<int:pk>/order', async_views.work_shift_orders),
 ]
@@ -1,5 +1,16 @@
 from django.utils.crypto import get_random_string
+from rest_framework.authentication import get_authorization_header
 
 
 def get_name_file(instance, filename):
     return '/'.join([get_random_string(length=5)+'_'+filename])
+
+
+def get_bearer_token(request, keyword='Bearer'):
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2 or auth[0].lower() != keyword.lower().encode():
+        return None
+    try:
+        return auth[1].decode()
+    except UnicodeError:
+        return None
@@ -1,18 +1,40 @@
-from django.utils.crypto import get_random_string
+import csv
+import io
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes, action
+from rest_framework.decorators import api_view, permission_classes, throttle_classes, action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
+from . import caching, events, routers
+from .analytics import RevenueReport
+from .archive import get_archived_shifts
+from .authentication import token_cache
+from .backends.pool import get_pool_stats
 from .exceptions import CafeValidationAPIException, CafeAPIException
-from .models import User, WorkShift, ShiftWorker
+from .exports import OrderExport
+from .jobs import report_storage, validate_params
+from .models import User, WorkShift, ShiftWorker, Order, OrderMenu, Role, ApiToken, DailyRevenue, ReportJob
+from .pagination import KeysetPagination
 from .permissions import IsAuthenticated, IsAdmin
+from .reference import reference_data
+from .reports import ShiftOrdersReport
 from .serializers import UserSerializer, LoginSerializer, UserCreateSerializer, WorkShiftSerializer, \
-    WorkSiftDetailSerializer, ShiftWorkerSerializer, ShiftOrdersSerializer
+    WorkSiftDetailSerializer, ShiftWorkerSerializer, OrderExportSerializer, ShiftWorkerBulkSerializer, \
+    ShiftWorkerIdsSerializer, UserImportSerializer, UserValuesSerializer, OrderCreateSerializer, \
+    OrderItemsSerializer, OrderPositionIdsSerializer, OrderValuesSerializer, OrderPositionValuesSerializer, \
+    RevenueAnalyticsSerializer, ReportJobCreateSerializer, ReportJobSerializer
+from .throttling import LoginThrottle
 
 
 @api_view(['POST'])
+@throttle_classes([LoginThrottle])
 def login(request):
     serializer = LoginSerializer(data=request.data)
     if not (serializer.is_valid()):
@@ -25,12 +47,11 @@ def login(request):
         raise CafeAPIException(message='Authentication failed',
                                code=status.HTTP_401_UNAUTHORIZED)
 
-    user.api_token = get_random_string(length=32)
-    user.save()
+    token = ApiToken.issue(user, device=request.META.get('HTTP_USER_AGENT', '')[:254])
 
     response = {
         'data': {
-            'user_token': user.api_token,
+            'user_token': token,
         }
     }
     return Response(response, status=status.HTTP_200_OK)
@@ -39,9 +60,8 @@ def login(request):
 @api_view(['GET'])
 @permission_classes((IsAuthenticated,))
 def logout(request):
-    user = User.get_auth_user(request)
-    user.api_token = None
-    user.save()
+    token_cache.invalidate(request.auth)
+    ApiToken.revoke(request.auth)
     response = {
         'date': {
             'message': 'Logout',
@@ -50,13 +70,53 @@ def logout(request):
     return Response(response, status=status.HTTP_200_OK)
 
 
+@api_view(['GET'])
+@permission_classes((IsAdmin,))
+def db_pool(request):
+    response = {
+        'data': get_pool_stats()
+    }
+    return Response(response, status=status.HTTP_200_OK)
+
+
 class UserList(APIView):
     permission_classes = [IsAdmin]
 
+    pagination_class = KeysetPagination
+    # renders the page from values() rows, None falls back to UserSerializer
+    values_serializer_class = UserValuesSerializer
+
+    def get_fields(self, request):
+        fields = request.query_params.get('fields')
+        if not fields:
+            return UserSerializer.default_fields
+        fields = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in fields if name not in UserSerializer.Meta.fields]
+        if unknown:
+            raise CafeValidationAPIException(message='Validation error',
+                                             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                             errors={'fields': ['Unknown field: %s' % name for name in unknown]})
+        return fields
+
+    def list(self, request):
+        fields = self.get_fields(request)
+        paginator = self.pagination_class()
+        if self.values_serializer_class is not None:
+            serializer = self.values_serializer_class(fields)
+            page = paginator.paginate_queryset(serializer.values(User.objects.all()), request, view=self)
+            return paginator.get_paginated_response(serializer.serialize(page))
+
+        model_fields = UserSerializer.get_model_fields(fields)
+        snippets = User.objects.only(*model_fields)
+        if 'group' in fields:
+            snippets = snippets.select_related('role').only('role', *model_fields)
+
+        page = paginator.paginate_queryset(snippets, request, view=self)
+        serializer = UserSerializer(page, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data['data'])
+
     def get(self, request, format=None):
-        snippets = User.objects.all()
-        serializer = UserSerializer(snippets, many=True)
-        return Response(serializer.data)
+        return caching.conditional_response(request, [caching.USERS], lambda: self.list(request).data)
 
     def post(self, request, format=None):
         serializer = UserCreateSerializer(data=request.data)
@@ -75,6 +135,52 @@ class UserList(APIView):
         return Response(response, status=status.HTTP_201_CREATED)
 
 
+class UserImport(APIView):
+    permission_classes = [IsAdmin]
+
+    def get_rows(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return request.data
+        reader = csv.DictReader(io.TextIOWrapper(upload.file, encoding='utf-8-sig'))
+        return [row for row in reader]
+
+    def post(self, request, format=None):
+        rows = self.get_rows(request)
+        if not isinstance(rows, list) or not rows:
+            raise CafeValidationAPIException(message='Validation error',
+                                             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                             errors={'non_field_errors': ['Expected a non-empty list of users.']})
+
+        roles = set(Role.objects.values_list('id', flat=True))
+        serializer = UserImportSerializer(data=rows, many=True, context={'roles': roles})
+        if not (serializer.is_valid()):
+            errors = serializer.errors
+            if isinstance(errors, list):
+                errors = {index: row_errors for index, row_errors in enumerate(errors) if row_errors}
+            raise CafeValidationAPIException(message='Validation error',
+                                             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                             errors=errors)
+
+        users = [User(**row) for row in serializer.validated_data]
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users, batch_size=getattr(settings, 'API_IMPORT_BATCH_SIZE', 500))
+                caching.bump_versions([caching.USERS])
+        except IntegrityError:
+            # a concurrent import or user creation took one of the logins
+            raise CafeValidationAPIException(message='Validation error',
+                                             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                             errors={'login': ['user with this login already exists.']})
+        response = {
+            'data': {
+                'count': len(users),
+                'status': 'created'
+            }
+        }
+        return Response(response, status=status.HTTP_201_CREATED)
+
+
 class WorkShiftViewSet(ModelViewSet):
     permission_classes = [IsAdmin]
     queryset = WorkShift.objects.all()
@@ -91,17 +197,29 @@ class WorkShiftViewSet(ModelViewSet):
 
     @action(methods=['GET'], detail=True)
     def open(self, request, pk=None):
+        routers.use_primary()
         if WorkShift.objects.filter(active=True).first():
             raise CafeAPIException(message='Forbidden. There are open shifts!',
                                    code=status.HTTP_403_FORBIDDEN)
         work_shift = self.get_object()
         work_shift.active = True
-        work_shift.save()
+        try:
+            with transaction.atomic():
+                # locked, so the shift is not archived before it is saved
+                if WorkShift.objects.select_for_update().filter(pk=work_shift.pk) \
+                        .values_list('archived_at', flat=True).get() is not None:
+                    raise CafeAPIException(message='Forbidden. The shift is archived!',
+                                           code=status.HTTP_403_FORBIDDEN)
+                work_shift.save()
+        except IntegrityError:
+            raise CafeAPIException(message='Forbidden. There are open shifts!',
+                                   code=status.HTTP_403_FORBIDDEN)
         serializer = WorkSiftDetailSerializer(work_shift)
         return Response(serializer.data)
 
     @action(methods=['GET'], detail=True)
     def close(self, request, pk=None):
+        routers.use_primary()
         work_shift = self.get_object()
         if not work_shift.active:
             raise CafeAPIException(message='Forbidden. The shift is already closed!',
@@ -126,8 +244,13 @@ class WorkShiftViewSet(ModelViewSet):
             raise CafeAPIException(message='Forbidden. The worker is already on shift!',
                                    code=status.HTTP_403_FORBIDDEN)
 
-        ShiftWorker.objects.create(user=user,
-                                   work_shift=work_shift)
+        try:
+            with transaction.atomic():
+                ShiftWorker.objects.create(user=user,
+                                           work_shift=work_shift)
+        except IntegrityError:
+            raise CafeAPIException(message='Forbidden. The worker is already on shift!',
+                                   code=status.HTTP_403_FORBIDDEN)
         response = {
             'data': {
                 'id_user': user.id,
@@ -136,10 +259,274 @@ class WorkShiftViewSet(ModelViewSet):
         }
         return Response(response, status=status.HTTP_200_OK)
 
+    def add_workers(self, pairs):
+        shift_ids = {work_shift_id for work_shift_id, _ in pairs}
+        user_ids = {user_id for _, user_id in pairs}
+        existing_shifts = set(WorkShift.objects.filter(id__in=shift_ids).values_list('id', flat=True))
+        existing_users = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        on_shift = set(ShiftWorker.objects.filter(work_shift_id__in=shift_ids, user_id__in=user_ids)
+                       .values_list('work_shift_id', 'user_id'))
+        on_shift_before = set(on_shift)
+
+        results = []
+        new_workers = []
+        for work_shift_id, user_id in pairs:
+            if work_shift_id not in existing_shifts:
+                item_status = 'work shift not found'
+            elif user_id not in existing_users:
+                item_status = 'user not found'
+            elif (work_shift_id, user_id) in on_shift:
+                item_status = 'already on shift'
+            else:
+                item_status = 'added'
+                on_shift.add((work_shift_id, user_id))
+                new_workers.append(ShiftWorker(work_shift_id=work_shift_id, user_id=user_id))
+            results.append({
+                'id_work_shift': work_shift_id,
+                'id_user': user_id,
+                'status': item_status
+            })
+
+        while True:
+            try:
+                with transaction.atomic():
+                    ShiftWorker.objects.bulk_create(new_workers)
+                    caching.bump_versions({caching.work_shift_key(worker.work_shift_id) for worker in new_workers})
+                break
+            except IntegrityError:
+                # a concurrent request added some of the workers first
+                added = set(ShiftWorker.objects.filter(work_shift_id__in=shift_ids, user_id__in=user_ids)
+                            .values_list('work_shift_id', 'user_id')) - on_shift_before
+                if not any((worker.work_shift_id, worker.user_id) in added for worker in new_workers):
+                    raise
+                new_workers = [worker for worker in new_workers if (worker.work_shift_id, worker.user_id) not in added]
+                for result in results:
+                    if result['status'] == 'added' and (result['id_work_shift'], result['id_user']) in added:
+                        result['status'] = 'already on shift'
+        return Response({'data': results}, status=status.HTTP_200_OK)
+
+    @action(methods=['POST'], detail=True)
+    def users(self, request, pk=None):
+        serializer = ShiftWorkerIdsSerializer(data=request.data)
+        if not (serializer.is_valid()):
+            raise CafeValidationAPIException(message='Validation error',
+                                             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                             errors=serializer.errors)
+        work_shift = self.get_object()
+        return self.add_workers([(work_shift.id, user_id) for user_id in serializer.validated_data['user_ids']])
+
+    @action(methods=['POST'], detail=False, url_path='users')
+    def bulk_users(self, request):
+        serializer = ShiftWorkerBulkSerializer(data=request.data)
+        if not (serializer.is_valid()):
+            raise CafeValidationAPIException(message='Validation error',
+                                             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                             errors=serializer.errors)
+        return self.add_workers([(worker['work_shift_id'], worker['user_id'])
+                                 for worker in serializer.validated_data['workers']])
+
     @action(methods=['GET'], detail=True)
     def order(self, request, pk=None):
+        def build():
+            work_shift = self.get_object()
+            report = ShiftOrdersReport(work_shift)
+            return {
+                'data': report.data
+            }
+
+        # keyed like the writes, by the id, so "05" is invalidated with shift 5
+        work_shift_id = int(pk) if pk.isdecimal() else pk
+        return caching.conditional_response(request, [caching.WORK_SHIFTS, caching.work_shift_key(work_shift_id)],
+                                            build)
+
+    def export_orders(self, request, orders, archived_shifts, filename):
+        serializer = OrderExportSerializer(data=request.query_params)
+        if not (serializer.is_valid()):
+            raise CafeValidationAPIException(message='Validation error',
+                                             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                             errors=serializer.errors)
+        params = serializer.validated_data
+        orders = OrderExport.filter_orders(orders, params)
+        archived_shifts = archived_shifts.filter(id__in=get_archived_shifts(params.get('start'), params.get('end')))
+
+        export_type = params['type']
+        response = StreamingHttpResponse(OrderExport(orders).stream(export_type),
+                                         content_type=OrderExport.content_types[export_type])
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (filename, export_type)
+        # the orders of archived shifts are only kept in their archives
+        response['X-Export-Complete'] = 'false' if archived_shifts.exists() else 'true'
+        return response
+
+    @action(methods=['GET'], detail=True, url_path='order/export')
+    def order_export(self, request, pk=None):
         work_shift = self.get_object()
-        serializer = ShiftOrdersSerializer(work_shift)
-        return Response({
-            'data': serializer.data
-        })
+        orders = Order.objects.filter(shift_worker__work_shift=work_shift)
+        return self.export_orders(request, orders, WorkShift.objects.filter(pk=work_shift.pk),
+                                  'work-shift-%d-orders' % work_shift.id)
+
+    @action(methods=['GET'], detail=False, url_path='order/export')
+    def orders_export(self, request):
+        return self.export_orders(request, Order.objects.all(), WorkShift.objects.all(), 'orders')
+
+
+class RevenueAnalytics(APIView):
+    permission_classes = [IsAdmin]
+
+    def get(self, request, format=None):
+        serializer = RevenueAnalyticsSerializer(data=request.query_params)
+        if not (serializer.is_valid()):
+            raise CafeValidationAPIException(message='Validation error',
+                                             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                             errors=serializer.errors)
+        report = RevenueReport(**serializer.validated_data)
+        return Response({'data': report.data})
+
+
+class OrderMixin:
+    """Shared steps of the waiter endpoints that write orders and their lines."""
+    permission_classes = [IsAuthenticated]
+    # orders in these statuses are closed for changes
+    closed_statuses = ['paid-up']
+
+    def validate(self, serializer_class, data):
+        serializer = serializer_class(data=data)
+        if not (serializer.is_valid()):
+            raise CafeValidationAPIException(message='Validation error',
+                                             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                             errors=serializer.errors)
+        return serializer.validated_data
+
+    def get_order(self, request, pk):
+        order = Order.objects.select_related('shift_worker').filter(pk=pk).first()
+        if order is None:
+            raise CafeAPIException(message='Order not found', code=status.HTTP_404_NOT_FOUND)
+        if order.shift_worker.user_id != request.user.id:
+            raise CafeAPIException(message='Forbidden. You did not accept this order!',
+                                   code=status.HTTP_403_FORBIDDEN)
+        if reference_data.get('statuses', order.status_order_id).code in self.closed_statuses:
+            raise CafeAPIException(message='Forbidden! Cannot be changed in an order with this status',
+                                   code=status.HTTP_403_FORBIDDEN)
+        return order
+
+    def add_items(self, order, items):
+        OrderMenu.objects.bulk_create([OrderMenu(order=order, menu_id=item['menu_id'], quantity=item['quantity'])
+                                       for item in items])
+
+    def update_rollups(self, order):
+        # bulk_create and raw deletes skip the signals that maintain the rollups and the ETags
+        Order.update_total_prices(Order.objects.filter(id=order.id))
+        WorkShift.update_total_prices(WorkShift.objects.filter(id=order.shift_worker.work_shift_id))
+        caching.bump_versions([caching.work_shift_key(order.shift_worker.work_shift_id)])
+
+    def get_order_data(self, order):
+        order_serializer = OrderValuesSerializer()
+        data = order_serializer.to_representation(order_serializer.values(Order.objects.filter(id=order.id)).get())
+        position_serializer = OrderPositionValuesSerializer()
+        positions = position_serializer.values(OrderMenu.objects.filter(order=order).order_by('id'))
+        data['positions'] = position_serializer.serialize(positions)
+        return {
+            'data': data
+        }
+
+
+class OrderCreate(OrderMixin, APIView):
+
+    def post(self, request, format=None):
+        params = self.validate(OrderCreateSerializer, request.data)
+        shift_worker = ShiftWorker.objects.filter(user=request.user, work_shift__active=True).first()
+        if shift_worker is None:
+            raise CafeAPIException(message="Forbidden. You don't work this shift!",
+                                   code=status.HTTP_403_FORBIDDEN)
+        taken = reference_data.get_by_code('statuses', 'taken')
+        if taken is None:
+            raise CafeAPIException(message='The status of new orders does not exist',
+                                   code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        with transaction.atomic():
+            order = Order.objects.create(shift_worker=shift_worker, table_id=params['table_id'],
+                                         number_of_person=params['number_of_person'],
+                                         status_order_id=taken.id, created_at=timezone.now())
+            if params.get('items'):
+                self.add_items(order, params['items'])
+                self.update_rollups(order)
+        return Response(self.get_order_data(order), status=status.HTTP_201_CREATED)
+
+
+class OrderPositions(OrderMixin, APIView):
+
+    def post(self, request, pk, format=None):
+        items = self.validate(OrderItemsSerializer, request.data)['items']
+        with transaction.atomic():
+            order = self.get_order(request, pk)
+            self.add_items(order, items)
+            self.update_rollups(order)
+            DailyRevenue.invalidate([order.shift_worker.work_shift_id])
+            events.publish_order(events.ORDER_UPDATED, order.id)
+        return Response(self.get_order_data(order), status=status.HTTP_201_CREATED)
+
+    def delete(self, request, pk, format=None):
+        position_ids = self.validate(OrderPositionIdsSerializer, request.data)['position_ids']
+        with transaction.atomic():
+            order = self.get_order(request, pk)
+            positions = OrderMenu.objects.filter(order=order, id__in=position_ids)
+            # a single DELETE, OrderMenu has no dependent rows to collect
+            positions._raw_delete(positions.db)
+            self.update_rollups(order)
+            DailyRevenue.invalidate([order.shift_worker.work_shift_id])
+            events.publish_order(events.ORDER_UPDATED, order.id)
+        return Response(self.get_order_data(order), status=status.HTTP_200_OK)
+
+
+class ReportJobViewSet(GenericViewSet):
+    """Reports that are too large for one request, computed by the run_report_jobs command."""
+    permission_classes = [IsAdmin]
+    queryset = ReportJob.objects.all()
+
+    def get_response(self, job, status_code=status.HTTP_200_OK):
+        serializer = ReportJobSerializer(job, context={'request': self.request})
+        return Response({'data': serializer.data}, status=status_code)
+
+    def create(self, request, *args, **kwargs):
+        serializer = ReportJobCreateSerializer(data=request.data)
+        if not (serializer.is_valid()):
+            raise CafeValidationAPIException(message='Validation error',
+                                             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                             errors=serializer.errors)
+        kind = serializer.validated_data['kind']
+        params = serializer.validated_data['params']
+        try:
+            validated, dedup_key = validate_params(kind, params)
+        except ValidationError as exc:
+            raise CafeValidationAPIException(message='Validation error',
+                                             code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                             errors={'params': exc.detail})
+
+        params = {name: value for name, value in params.items() if name in validated}
+        job, created = ReportJob.submit(request.user, kind, params, dedup_key)
+        # an identical report that is still queued or running is answered instead of queueing it again
+        return self.get_response(job, status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+
+    def retrieve(self, request, pk=None):
+        return self.get_response(self.get_object())
+
+    @action(methods=['POST'], detail=True)
+    def cancel(self, request, pk=None):
+        job = self.get_object()
+        if not job.cancel():
+            raise CafeAPIException(message='Forbidden. The job has already finished!',
+                                   code=status.HTTP_403_FORBIDDEN)
+        job.refresh_from_db()
+        return self.get_response(job)
+
+    @action(methods=['GET'], detail=True)
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != ReportJob.DONE:
+            raise CafeAPIException(message='The report is not ready',
+                                   code=status.HTTP_409_CONFLICT)
+        try:
+            file = report_storage.open(job.file_name, 'rb')
+        except FileNotFoundError:
+            job.expire()
+            raise CafeAPIException(message='The report file no longer exists', code=status.HTTP_404_NOT_FOUND)
+        return FileResponse(file, as_attachment=True, filename=job.file_name)
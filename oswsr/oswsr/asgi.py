@@ -13,4 +13,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'oswsr.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from api.async_views import order_feed  # noqa: E402, the apps have to be loaded first
+
+# long-lived streams that bypass the Django request handler
+streams = {
+    '/api-cafe/events/order': order_feed,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] in streams:
+        return await streams[scope['path']](scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,6 +41,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.throttling.ConcurrencyLimitMiddleware',
+    'api.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -49,6 +53,53 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'api.authentication.BearerTokenAuthentication',
+    ],
+    # orjson backed when it is installed, stdlib json otherwise
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # in-process token buckets per bearer token, login per address
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.BearerTokenThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'token': '600/min',
+        'login': '10/min',
+    },
+    'EXCEPTION_HANDLER': 'api.exceptions.exception_handler',
+}
+
+# Token buckets kept per process, the least recently used are dropped first
+API_THROTTLE_STORE_SIZE = 10000
+
+# Requests in flight per route and process before new ones get a 503,
+# API_CONCURRENCY_LIMITS overrides single routes, e.g.
+# {'api-cafe/^work-shift/(?P<pk>[^/.]+)/order$': 10}
+API_CONCURRENCY_LIMIT = 50
+API_CONCURRENCY_LIMITS = {}
+
+# Seconds a login token stays valid, clear_tokens removes expired ones
+API_TOKEN_LIFETIME = 30 * 24 * 60 * 60
+
+# Authenticated users are cached per process by their api token
+API_TOKEN_CACHE_TTL = 300
+API_TOKEN_CACHE_SIZE = 1024
+
+# Rows per INSERT statement of the bulk user import
+API_IMPORT_BATCH_SIZE = 500
+
+# Requests running more SQL queries than this are logged as warnings
+API_QUERY_BUDGET = 20
+
 ROOT_URLCONF = 'oswsr.urls'
 
 TEMPLATES = [
@@ -72,9 +123,13 @@ WSGI_APPLICATION = 'oswsr.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# The api.backends engines wrap the Django backends with a per-process
+# connection pool: MAX_SIZE connections per worker, connections older than
+# MAX_AGE seconds are reopened, HEALTH_CHECKS pings a connection on checkout
+# and TIMEOUT is how long a request waits for a free connection.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'api.backends.mysql',
         'NAME': 'cafe-api',
         'USER': 'user',
         'PASSWORD': 'user',
@@ -84,9 +139,59 @@ DATABASES = {
         'OPTIONS': {
             'charset': 'utf8mb4',
         },
+        'POOL': {
+            'MAX_SIZE': 10,
+            'MAX_AGE': 600,
+            'HEALTH_CHECKS': True,
+            'TIMEOUT': 10,
+        },
     }
 }
 
+# Safe requests read from one of the API_DATABASE_REPLICAS aliases, e.g.
+# 'replica': {..., 'TEST': {'MIRROR': 'default'}}. After a write the client
+# and the changed resources read from the primary for
+# API_DATABASE_STICKY_SECONDS, longer than the replication lag.
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+API_DATABASE_REPLICAS = []
+API_DATABASE_STICKY_SECONDS = 5
+
+# MySQL ignores the condition of work_shifts_single_active, the api
+# migrations create an equivalent functional unique index instead
+SILENCED_SYSTEM_CHECKS = ['models.W036']
+
+# Caches
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+# The api cache holds the ETag versions and rendered data of the user list
+# and the shift reports, and the reference data version. It must be shared
+# by all worker processes: with a per-process cache a write bumps only the
+# versions of its own worker, and the others keep answering from their
+# stale copies. FileBasedCache shares it between the workers of one host,
+# use Redis or Memcached when the api runs on several hosts.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'oswsr-api-cache'),
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+API_RESPONSE_CACHE = 'api'
+
+# Seconds between checks of the reference data version set by other processes
+API_REFERENCE_DATA_CHECK_INTERVAL = 1
+
+# Events buffered per live order feed client before it is dropped, and the
+# seconds between keepalive comments on a quiet feed
+API_EVENTS_QUEUE_SIZE = 100
+API_EVENTS_KEEPALIVE = 15
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -133,3 +238,22 @@ AUTH_USER_MODEL = 'api.User'
 MEDIA_ROOT = os.path.join(BASE_DIR.parent, 'photos')
 MEDIA_URL = '/photos/'
 
+# Report job files, served only through the api
+API_REPORTS_ROOT = os.path.join(BASE_DIR.parent, 'reports')
+
+# Worker threads of run_report_jobs, and the seconds a running job may go
+# without reporting progress before it is queued again
+API_REPORT_WORKERS = 2
+API_REPORT_JOB_TIMEOUT = 300
+
+# Days a closed shift keeps its orders before archive_shifts compresses them
+# into a shift archive
+API_ARCHIVE_RETENTION_DAYS = 90
+
+# WebP variants of user photos (longest side in pixels), created by
+# PHOTO_WORKERS background threads after the upload is stored
+PHOTO_VARIANTS = {
+    'thumb': 128,
+    'medium': 512,
+}
+PHOTO_WORKERS = 2
@@ -1,5 +1,8 @@
 from django.urls import path, include
 
+from api.metrics import metrics
+
 urlpatterns = [
     path('api-cafe/', include('api.urls')),
+    path('metrics', metrics),
 ]